@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import CustomUser, Profile, Booking, Hotel, HotelImage, Review, Transaction
+from .models import (
+    CustomUser, Profile, Booking, Hotel, HotelImage, OutboundEmail, Review, RoomHold, RoomInventory, Transaction,
+    WalletCheckpoint,
+)
 # Register your models here.
 
 admin.site.register(CustomUser)
@@ -16,5 +19,38 @@ class HotelAdmin(admin.ModelAdmin):
     list_filter = ('location',)
     ordering = ('-created_at',)
 admin.site.register(HotelImage)
+
+@admin.register(RoomInventory)
+class RoomInventoryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'hotel', 'date', 'rooms_sold')
+    list_filter = ('hotel',)
+    ordering = ('hotel', 'date')
+
+@admin.register(RoomHold)
+class RoomHoldAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'hotel', 'check_in', 'check_out', 'rooms', 'expires_at')
+    ordering = ('-created_at',)
+
 admin.site.register(Review)
-admin.site.register(Transaction)
\ No newline at end of file
+@admin.register(Transaction)
+class TransactionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'booking', 'amount', 'transaction_type', 'created_at')
+    ordering = ('-created_at',)
+
+    # Append-only ledger
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(WalletCheckpoint)
+class WalletCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'balance', 'last_transaction_id', 'created_at')
+    ordering = ('-created_at',)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
@@ -0,0 +1,133 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import bump_versions, get_versions
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def invalidate_user(user_id):
+    # Bumps the user's version in the shared cache after commit, so every
+    # process drops its snapshot on the next request, not only this one
+    scope = user_scope(user_id)
+    transaction.on_commit(lambda: bump_versions([scope]))
+
+
+class UserCache:
+    # Process-local snapshots of a user with their profile attached, keyed
+    # by user id. A snapshot is used while it is younger than the TTL and
+    # its version still matches the user's version in the shared cache;
+    # callers get a copy, so changes made during a request never leak into
+    # the cache.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        # Invalidation reaches other workers only through the default cache,
+        # so with a per-process one ('auto') the snapshots are not used and
+        # deactivations, password changes and balances apply immediately
+        setting = getattr(settings, 'AUTH_USER_CACHE', 'auto')
+        if setting == 'auto':
+            return not isinstance(caches['default'], (LocMemCache, DummyCache))
+        return bool(setting)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+
+    @property
+    def max_users(self):
+        return getattr(settings, 'AUTH_USER_CACHE_MAX_USERS', 10000)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'hits': self.hits, 'misses': self.misses, 'size': len(self._users)}
+
+    def _fresh_user(self, user_id, now, version):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        user, loaded_at, loaded_version = entry
+        if loaded_version != version or now - loaded_at > self.ttl:
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return user
+
+    def get(self, user_id):
+        # Raises DoesNotExist for an unknown id; a miss costs one query for
+        # the user and profile together
+        [(version, _modified)] = get_versions([user_scope(user_id)])
+        now = time.monotonic()
+        with self._lock:
+            user = self._fresh_user(user_id, now, version)
+            if user is not None:
+                self.hits += 1
+                return copy.deepcopy(user)
+            self.misses += 1
+
+        user = get_user_model().objects.select_related('profile').get(**{api_settings.USER_ID_FIELD: user_id})
+        with self._lock:
+            self._users[user_id] = (user, now, version)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return copy.deepcopy(user)
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication with the user (and profile) served from user_cache,
+    # so a warm request authenticates without touching the database
+
+    def get_user(self, validated_token):
+        if not user_cache.enabled:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        try:
+            user = user_cache.get(user_id)
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found') from e
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
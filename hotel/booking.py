@@ -0,0 +1,362 @@
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.utils import timezone
+
+from .inventory import (
+    NotEnoughRooms, booked_rooms, bump_version, claim_version, current_version, current_versions, release_rooms,
+    reserve_rooms,
+)
+from .models import Booking, RoomHold
+from .occupancy import OccupancyIndexUnavailable, nightly_occupancy, occupancy_index, overlapping_stays
+from .utils import send_user_mail
+from .wallet import InsufficientBalance, current_balance, pay, pay_many, refund
+
+
+class BookingError(Exception):
+    pass
+
+
+class VersionConflict(Exception):
+    pass
+
+
+def helper_functions(hotel, check_in, check_out, adults, children, rooms_requested, version=None):
+    # 1. Busiest night of the stay, from the in-memory index when possible
+    try:
+        peak = occupancy_index.peak(hotel.id, check_in, check_out, version)
+    except OccupancyIndexUnavailable:
+        peak = booked_rooms(hotel, check_in, check_out)
+    available_rooms = hotel.total_rooms - peak
+    if available_rooms < rooms_requested:
+        return False, 'Not enough rooms available for the selected dates.'
+
+    # 2. Capacity check
+    total_capacity = rooms_requested * (hotel.capacity_per_room or 0)
+    if (adults + children) > total_capacity:
+        return False, 'Selected rooms cannot accommodate the number of guests.'
+
+    return True, {
+        "available_rooms": available_rooms,
+        "capacity_per_room": hotel.capacity_per_room,
+        "price_per_night": hotel.price_per_night
+    }
+
+
+def _retry_backoff(attempt):
+    time.sleep(random.uniform(0, 0.005 * 2 ** min(attempt, 6)))
+
+
+def optimistically(attempt, conflict_message):
+    # Runs attempt() until it gets through without losing a version
+    # compare-and-swap to a concurrent writer, backing off between tries
+    for retry in range(getattr(settings, 'BOOKING_MAX_ATTEMPTS', 10)):
+        try:
+            return attempt()
+        except (NotEnoughRooms, InsufficientBalance) as e:
+            raise BookingError(str(e))
+        except VersionConflict:
+            _retry_backoff(retry)
+        except OperationalError as e:
+            # SQLite reports a concurrent writer as a lock error rather than
+            # blocking; treat it like a lost swap
+            if 'locked' not in str(e):
+                raise
+            _retry_backoff(retry)
+
+    raise BookingError(conflict_message)
+
+
+def book_stay(user, hotel, check_in, check_out, adults=1, children=0, rooms_requested=1):
+    # Optimistic booking pipeline. Availability is checked against the
+    # inventory version that was read first; the transaction then claims
+    # that version with a compare-and-swap before writing anything. Losing
+    # the swap means another booking for the same hotel committed in
+    # between, so we re-check and retry. Bookings for different hotels
+    # never contend.
+    nights = (check_out - check_in).days
+    total_price = hotel.price_per_night * rooms_requested * nights
+
+    def attempt():
+        version = current_version(hotel.id)
+        is_available, data = helper_functions(
+            hotel, check_in, check_out, adults, children, rooms_requested, version
+        )
+        if not is_available:
+            raise BookingError(data)
+
+        with transaction.atomic():
+            if not claim_version(hotel.id, version):
+                raise VersionConflict()
+
+            reserve_rooms(hotel, check_in, check_out, rooms_requested)
+
+            booking = Booking.objects.create(
+                user=user,
+                hotel=hotel,
+                check_in=check_in,
+                check_out=check_out,
+                adults=adults,
+                children=children,
+                rooms=rooms_requested,
+                total_price=total_price,
+                status='booked'
+            )
+
+            pay(user.id, total_price, booking)
+
+            send_user_mail(
+                user,
+                "Booking Confirmed",
+                f"Dear {user.first_name}, your booking for {hotel.name} "
+                f"from {check_in} to {check_out} is confirmed.\nTotal Paid: {total_price}."
+            )
+            transaction.on_commit(lambda: occupancy_index.advance(hotel.id, version, version + 1))
+        return booking
+
+    return optimistically(attempt, 'Too many concurrent bookings for this hotel, please try again.')
+
+
+def hold_rooms(user, hotel, check_in, check_out, adults=1, children=0, rooms_requested=1):
+    # Sets rooms aside for ROOM_HOLD_TTL seconds without paying for them.
+    # The hold goes through the same availability check and version swap as
+    # a booking, so held rooms can't be sold to anyone else until it expires
+    # or is converted with book_hold.
+    ttl = timedelta(seconds=getattr(settings, 'ROOM_HOLD_TTL', 600))
+
+    def attempt():
+        version = current_version(hotel.id)
+        is_available, data = helper_functions(
+            hotel, check_in, check_out, adults, children, rooms_requested, version
+        )
+        if not is_available:
+            raise BookingError(data)
+
+        with transaction.atomic():
+            if not claim_version(hotel.id, version):
+                raise VersionConflict()
+
+            hold = RoomHold.objects.create(
+                user=user,
+                hotel=hotel,
+                check_in=check_in,
+                check_out=check_out,
+                adults=adults,
+                children=children,
+                rooms=rooms_requested,
+                expires_at=timezone.now() + ttl,
+            )
+
+            def update_index():
+                occupancy_index.apply(hotel.id, check_in, check_out, rooms_requested, hold.expires_at)
+                occupancy_index.advance(hotel.id, version, version + 1)
+            transaction.on_commit(update_index)
+        return hold
+
+    return optimistically(attempt, 'Too many concurrent bookings for this hotel, please try again.')
+
+
+def book_hold(user, token):
+    # Converts an active hold into a paid booking. The held rooms already
+    # count as taken, so there is no availability check to repeat.
+    def attempt():
+        hold = RoomHold.objects.active().select_related('hotel').filter(user=user, token=token).first()
+        if hold is None:
+            raise BookingError('Hold not found or expired.')
+        hotel = hold.hotel
+        version = current_version(hotel.id)
+        total_price = stay_price({
+            'hotel': hotel, 'rooms': hold.rooms, 'check_in': hold.check_in, 'check_out': hold.check_out,
+        })
+
+        with transaction.atomic():
+            if not claim_version(hotel.id, version):
+                raise VersionConflict()
+            # Conditional delete, so a hold is converted at most once and
+            # never after it expired
+            if not RoomHold.objects.active().filter(pk=hold.pk).delete()[0]:
+                raise BookingError('Hold not found or expired.')
+
+            reserve_rooms(hotel, hold.check_in, hold.check_out, hold.rooms)
+
+            booking = Booking.objects.create(
+                user=user,
+                hotel=hotel,
+                check_in=hold.check_in,
+                check_out=hold.check_out,
+                adults=hold.adults,
+                children=hold.children,
+                rooms=hold.rooms,
+                total_price=total_price,
+                status='booked'
+            )
+
+            pay(user.id, total_price, booking)
+
+            send_user_mail(
+                user,
+                "Booking Confirmed",
+                f"Dear {user.first_name}, your booking for {hotel.name} "
+                f"from {hold.check_in} to {hold.check_out} is confirmed.\nTotal Paid: {total_price}."
+            )
+
+            # The booking signal adds the rooms back once this commits
+            def update_index():
+                occupancy_index.apply(hotel.id, hold.check_in, hold.check_out, -hold.rooms)
+                occupancy_index.advance(hotel.id, version, version + 1)
+            transaction.on_commit(update_index)
+        return booking
+
+    return optimistically(attempt, 'Too many concurrent bookings for this hotel, please try again.')
+
+
+def release_hold(hold):
+    # Returns False if the hold had already expired, been released or been
+    # converted into a booking
+    with transaction.atomic():
+        if not RoomHold.objects.active().filter(pk=hold.pk).delete()[0]:
+            return False
+        bump_version(hold.hotel_id)
+        transaction.on_commit(
+            lambda: occupancy_index.apply(hold.hotel_id, hold.check_in, hold.check_out, -hold.rooms)
+        )
+    return True
+
+
+def stay_price(stay):
+    return stay['hotel'].price_per_night * stay['rooms'] * (stay['check_out'] - stay['check_in']).days
+
+
+def check_stays(stays, balance):
+    # Availability, capacity and funds for a basket of stays, using one
+    # occupancy query for every hotel and date in it. Stays accepted earlier
+    # in the list count towards the rooms and balance seen by later ones.
+    # Returns None for each stay that fits and the reason for each that
+    # doesn't.
+    start = min(stay['check_in'] for stay in stays)
+    end = max(stay['check_out'] for stay in stays)
+    hotel_ids = {stay['hotel'].id for stay in stays}
+
+    booked = defaultdict(list)
+    for hotel_id, check_in, check_out, rooms in overlapping_stays(hotel_ids, start, end):
+        booked[hotel_id].append((check_in, check_out, rooms))
+    occupancy = {hotel_id: nightly_occupancy(booked[hotel_id], start, end) for hotel_id in hotel_ids}
+
+    errors = []
+    for stay in stays:
+        hotel = stay['hotel']
+        nights = occupancy[hotel.id]
+        lo = (stay['check_in'] - start).days
+        hi = (stay['check_out'] - start).days
+        price = stay_price(stay)
+
+        if (hotel.total_rooms or 0) - max(nights[lo:hi]) < stay['rooms']:
+            errors.append('Not enough rooms available for the selected dates.')
+        elif stay['adults'] + stay['children'] > stay['rooms'] * (hotel.capacity_per_room or 0):
+            errors.append('Selected rooms cannot accommodate the number of guests.')
+        elif price > balance:
+            errors.append('Insufficient wallet balance.')
+        else:
+            for i in range(lo, hi):
+                nights[i] += stay['rooms']
+            balance -= price
+            errors.append(None)
+    return errors
+
+
+def book_stays(user, stays, all_or_nothing=True):
+    # Bulk version of book_stay for a list of stays (dicts with hotel,
+    # check_in, check_out, adults, children and rooms). Every hotel in the
+    # basket is claimed with the same version compare-and-swap, the wallet
+    # is debited once for the total, and bookings and their payments are
+    # inserted in bulk. Returns one (booking, error) pair per stay; with
+    # all_or_nothing a single rejected stay books nothing.
+    hotel_ids = sorted({stay['hotel'].id for stay in stays})
+
+    def attempt():
+        versions = current_versions(hotel_ids)
+        errors = check_stays(stays, current_balance(user.id))
+        accepted = [stay for stay, error in zip(stays, errors) if error is None]
+        if not accepted or (all_or_nothing and len(accepted) < len(stays)):
+            return [(None, error or 'Not booked: another stay in the basket was rejected.') for error in errors]
+
+        with transaction.atomic():
+            # Claimed in hotel id order so overlapping baskets can't
+            # deadlock each other
+            claimed = sorted({stay['hotel'].id for stay in accepted})
+            for hotel_id in claimed:
+                if not claim_version(hotel_id, versions[hotel_id]):
+                    raise VersionConflict()
+
+            for stay in accepted:
+                reserve_rooms(stay['hotel'], stay['check_in'], stay['check_out'], stay['rooms'])
+
+            # bulk_create skips the Booking signals, so the occupancy
+            # index is updated by hand once the transaction commits
+            bookings = Booking.objects.bulk_create([
+                Booking(
+                    user=user,
+                    hotel=stay['hotel'],
+                    check_in=stay['check_in'],
+                    check_out=stay['check_out'],
+                    adults=stay['adults'],
+                    children=stay['children'],
+                    rooms=stay['rooms'],
+                    total_price=stay_price(stay),
+                    status='booked',
+                )
+                for stay in accepted
+            ])
+            pay_many(user.id, bookings)
+
+            send_user_mail(
+                user,
+                "Bookings Confirmed",
+                f"Dear {user.first_name}, your {len(bookings)} bookings are confirmed:\n"
+                + "\n".join(
+                    f"{booking.hotel.name} from {booking.check_in} to {booking.check_out}"
+                    for booking in bookings
+                )
+                + f"\nTotal Paid: {sum(booking.total_price for booking in bookings)}."
+            )
+
+            def update_index():
+                for booking in bookings:
+                    occupancy_index.apply(booking.hotel_id, booking.check_in, booking.check_out, booking.rooms)
+                for hotel_id in claimed:
+                    occupancy_index.advance(hotel_id, versions[hotel_id], versions[hotel_id] + 1)
+            transaction.on_commit(update_index)
+
+        booked = iter(bookings)
+        return [(None, error) if error else (next(booked), None) for error in errors]
+
+    return optimistically(attempt, 'Too many concurrent bookings for these hotels, please try again.')
+
+
+def cancel_stay(booking):
+    # Returns False if the booking was already cancelled. The status flip is
+    # a conditional UPDATE so two concurrent cancellations refund once.
+    with transaction.atomic():
+        cancelled = Booking.objects.filter(pk=booking.pk, status='booked').update(status='cancelled')
+        if not cancelled:
+            return False
+        booking.status = 'cancelled'
+
+        release_rooms(booking.hotel, booking.check_in, booking.check_out, booking.rooms)
+        bump_version(booking.hotel_id)
+
+        refund(booking.user_id, booking.total_price, booking)
+
+        user = booking.user
+        send_user_mail(
+            user,
+            "Booking Cancelled & Refund Processed",
+            f"Dear {user.first_name}, your booking at {booking.hotel.name} "
+            f"has been cancelled.\nRefund Amount: {booking.total_price} added back "
+            f"to your wallet.\nNew Balance: {current_balance(user.id)}."
+        )
+    return True
@@ -0,0 +1,75 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+CATALOGUE = 'catalogue'
+
+
+def hotel_scope(hotel_id):
+    return f'hotel:{hotel_id}'
+
+
+def _version_key(scope):
+    return f'hotel:version:{scope}'
+
+
+def get_versions(scopes):
+    # Each scope has a random token plus the time it last changed. Missing
+    # tokens (cold or evicted cache) are created fresh, so an old ETag can
+    # never match content it wasn't issued for.
+    keys = {_version_key(scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, (uuid.uuid4().hex, time.time()), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(scopes):
+    now = time.time()
+    cache.set_many({_version_key(scope): (uuid.uuid4().hex, now) for scope in scopes}, None)
+
+
+def bump_hotel_versions(hotel_ids):
+    # Runs after commit so a reader can't cache pre-change rows under the
+    # new version
+    scopes = [CATALOGUE, *(hotel_scope(hotel_id) for hotel_id in hotel_ids)]
+    transaction.on_commit(lambda: bump_versions(scopes))
+
+
+def cached_response(request, scopes, build):
+    # Conditional GET backed by versioned cache entries: the ETag is derived
+    # from the scope versions and the request, a matching If-None-Match (or
+    # If-Modified-Since) gets a 304, and otherwise the serialized body is
+    # served from the cache, calling build() only on a miss.
+    versions = get_versions(scopes)
+    fingerprint = hashlib.sha256('|'.join([
+        *(token for token, _ in versions),
+        request.get_host(),
+        request.get_full_path(),
+        request.accepted_renderer.format,
+    ]).encode()).hexdigest()
+    etag = f'"{fingerprint}"'
+    last_modified = int(max(modified for _, modified in versions))
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        body_key = f'hotel:response:{fingerprint}'
+        data = cache.get(body_key)
+        if data is None:
+            data = build()
+            cache.set(body_key, data, getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 300))
+        response = Response(data)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'no-cache'
+    return response
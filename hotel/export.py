@@ -0,0 +1,66 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Booking, Transaction
+
+EXPORTS = {
+    'bookings': (Booking, (
+        'id', 'user__email', 'hotel_id', 'hotel__name', 'check_in', 'check_out',
+        'adults', 'children', 'rooms', 'total_price', 'status', 'created_at',
+    )),
+    'transactions': (Transaction, (
+        'id', 'user__email', 'booking_id', 'amount', 'transaction_type', 'created_at',
+    )),
+}
+
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def export_queryset(kind, user=None, start=None, end=None):
+    # Rows created between start and end (both inclusive dates), oldest first
+    model, columns = EXPORTS[kind]
+    queryset = model.objects.all()
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    if start:
+        queryset = queryset.filter(created_at__gte=day_start(start))
+    if end:
+        queryset = queryset.filter(created_at__lt=day_start(end + timedelta(days=1)))
+    return queryset.order_by('id').values_list(*columns)
+
+
+class Echo:
+    # File-like object for csv.writer that hands each line back instead of
+    # storing it
+    def write(self, value):
+        return value
+
+
+def export_lines(kind, queryset, fmt, chunk_size=2000):
+    # Yields the export in blocks of chunk_size rows read through a
+    # database cursor, so memory use doesn't grow with the export
+    header = [column.replace('__', '_') for column in EXPORTS[kind][1]]
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        format_row = writer.writerow
+        yield writer.writerow(header)
+    else:
+        def format_row(row):
+            return json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + '\n'
+
+    block = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        block.append(format_row(row))
+        if len(block) >= chunk_size:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
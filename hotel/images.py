@@ -0,0 +1,196 @@
+import hashlib
+import io
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cache import bump_hotel_versions
+from .models import HotelImage
+
+# Longest side in pixels of each resized copy
+VARIANTS = {'thumb': 160, 'card': 480, 'full': 1600}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def file_hash(f):
+    digest = hashlib.sha256()
+    for chunk in f.chunks():
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def original_name(content_hash, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return f'hotel_images/{content_hash[:2]}/{content_hash}{extension}'
+
+
+def variant_name(content_hash, variant, fmt):
+    return f'hotel_images/variants/{content_hash[:2]}/{content_hash}-{variant}.{fmt}'
+
+
+def store_original(upload):
+    # Uploads are stored under their content hash, so the same picture
+    # uploaded twice shares one file
+    content_hash = file_hash(upload)
+    name = original_name(content_hash, upload.name)
+    if not default_storage.exists(name):
+        name = default_storage.save(name, upload)
+    return name, content_hash
+
+
+def render_variants(data):
+    # Pure Pillow work, run in worker processes: decode once, then shrink
+    # step by step from the largest variant to the smallest
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in image.mode or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    rendered = {}
+    for variant, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+        for fmt, (pil_format, options) in FORMATS.items():
+            out = image.convert('RGB') if fmt == 'jpeg' and image.mode != 'RGB' else image
+            buffer = io.BytesIO()
+            out.save(buffer, pil_format, **options)
+            rendered[variant, fmt] = buffer.getvalue()
+    return rendered
+
+
+def stored_variants(content_hash):
+    names = {
+        variant: {fmt: variant_name(content_hash, variant, fmt) for fmt in FORMATS}
+        for variant in VARIANTS
+    }
+    if all(default_storage.exists(name) for formats in names.values() for name in formats.values()):
+        return names
+    return None
+
+
+def save_variants(content_hash, rendered):
+    names = defaultdict(dict)
+    for (variant, fmt), data in rendered.items():
+        name = variant_name(content_hash, variant, fmt)
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(data))
+        names[variant][fmt] = name
+    return dict(names)
+
+
+def process_batch(images, pool):
+    # Hashes each original, renders every hash not already in storage once
+    # (in the pool) and records the variant names. Images that can't be
+    # read are marked processed with no variants, so they keep serving the
+    # original instead of being retried forever.
+    by_hash = defaultdict(list)
+    failed = []
+    sources = {}
+    for image in images:
+        try:
+            with default_storage.open(image.image.name) as f:
+                data = f.read()
+        except OSError:
+            failed.append(image)
+            continue
+        image.content_hash = image.content_hash or hashlib.sha256(data).hexdigest()
+        by_hash[image.content_hash].append(image)
+        sources.setdefault(image.content_hash, data)
+
+    variants = {}
+    to_render = {}
+    for content_hash, data in sources.items():
+        existing = stored_variants(content_hash)
+        if existing:
+            variants[content_hash] = existing
+        elif pool:
+            try:
+                to_render[content_hash] = pool.submit(render_variants, data)
+            except BrokenProcessPool:
+                failed.extend(by_hash.pop(content_hash))
+        else:
+            to_render[content_hash] = data
+
+    for content_hash, job in to_render.items():
+        # Besides unreadable files this covers decompression bombs and a
+        # worker that died on the image; either way the image is marked
+        # failed so it can't hold up the images queued after it
+        try:
+            rendered = job.result() if pool else render_variants(job)
+        except (UnidentifiedImageError, Image.DecompressionBombError, BrokenProcessPool, OSError, ValueError):
+            failed.extend(by_hash.pop(content_hash))
+            continue
+        variants[content_hash] = save_variants(content_hash, rendered)
+
+    now = timezone.now()
+    for content_hash, group in by_hash.items():
+        for image in group:
+            image.variants = variants[content_hash]
+            image.processed_at = now
+    for image in failed:
+        image.variants = {}
+        image.processed_at = now
+
+    # bulk_update skips the HotelImage signals, so the cached listings that
+    # embed image URLs are invalidated here
+    HotelImage.objects.bulk_update(images, ['content_hash', 'variants', 'processed_at'])
+    bump_hotel_versions({image.hotel_id for image in images})
+    return len(images) - len(failed), len(failed)
+
+
+def process_pending(batch_size=50, workers=None):
+    # Processes every image without variants yet: new uploads and, on the
+    # first run, everything uploaded before the pipeline existed. With
+    # workers=0 the rendering runs in this process.
+    processed = failed = 0
+    pending = HotelImage.objects.filter(processed_at__isnull=True).order_by('id')
+    pool = ProcessPoolExecutor(workers) if workers != 0 else None
+    try:
+        while True:
+            batch = list(pending[:batch_size])
+            if not batch:
+                break
+            # A worker killed mid-render breaks the whole pool; start afresh
+            # so the next batch isn't failed along with it
+            if pool and getattr(pool, '_broken', False):
+                pool.shutdown()
+                pool = ProcessPoolExecutor(workers)
+            done, errors = process_batch(batch, pool)
+            processed += done
+            failed += errors
+    finally:
+        if pool:
+            pool.shutdown()
+    return processed, failed
+
+
+def reuse_variants(image):
+    # A new upload whose content was already processed gets its variants
+    # straight away instead of waiting for the worker
+    twin = HotelImage.objects.filter(
+        content_hash=image.content_hash,
+        processed_at__isnull=False,
+    ).exclude(variants={}).exclude(pk=image.pk).first()
+    if twin is not None:
+        image.variants = twin.variants
+        image.processed_at = timezone.now()
+        image.save(update_fields=['variants', 'processed_at'])
+
+
+def variant_url(image_name, variants, variant, fmt='webp'):
+    # Storage URL of the requested variant, or of the original until the
+    # variants exist
+    name = (variants or {}).get(variant, {}).get(fmt) or image_name
+    return default_storage.url(name) if name else None
@@ -0,0 +1,107 @@
+import csv
+import json
+from collections import deque
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_hotel_versions
+from .models import Hotel, HotelImage, ImportCheckpoint
+from .serializers import HotelImportSerializer
+from .utils import normalize_location
+
+
+def image_references(images):
+    # Images may be given as plain storage names or as {"image", "alt_text"}
+    return [{'image': image} if isinstance(image, str) else image for image in images]
+
+
+def read_rows(path, fmt):
+    # Yields one record at a time, so a file of any size is imported in
+    # constant memory. Unparseable JSONL lines come through as None and are
+    # reported by validation like any other bad row.
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                # Empty cells mean "use the default"; images are '|'-separated
+                row = {key: value for key, value in row.items() if key and value not in ('', None)}
+                if 'images' in row:
+                    row['images'] = image_references(image for image in row['images'].split('|') if image)
+                yield row
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield None
+                    continue
+                if isinstance(row, dict) and isinstance(row.get('images'), list):
+                    row['images'] = image_references(row['images'])
+                yield row
+
+
+def validate_chunk(rows, first_row):
+    serializer = HotelImportSerializer()
+    valid, errors = [], []
+    for row_number, row in enumerate(rows, first_row):
+        try:
+            valid.append(serializer.run_validation(row))
+        except ValidationError as e:
+            errors.append((row_number, e.detail))
+    return valid, errors
+
+
+def insert_chunk(valid, batch_size):
+    # bulk_create skips Hotel.save() and the cache signals, so location_key
+    # and the catalogue version are handled here
+    hotels = Hotel.objects.bulk_create(
+        [
+            Hotel(
+                **{field: value for field, value in data.items() if field != 'images'},
+                location_key=normalize_location(data.get('location')),
+            )
+            for data in valid
+        ],
+        batch_size=batch_size,
+    )
+    HotelImage.objects.bulk_create(
+        [
+            HotelImage(hotel=hotel, image=image['image'], alt_text=image['alt_text'])
+            for hotel, data in zip(hotels, valid)
+            for image in data['images']
+        ],
+        batch_size=batch_size,
+    )
+    if hotels:
+        bump_hotel_versions([])
+    return len(hotels)
+
+
+def import_hotels(path, fmt='jsonl', batch_size=500, source=None, restart=False):
+    # Imports `path` in chunks of batch_size rows, yielding
+    # (rows done, hotels imported, row errors) after each one. Every chunk
+    # commits together with its checkpoint, so after a failure the next run
+    # for the same source picks up at the first uncommitted row.
+    checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=source or path)
+    if restart:
+        checkpoint.rows_done = 0
+        checkpoint.save(update_fields=['rows_done', 'updated_at'])
+
+    rows = read_rows(path, fmt)
+    done = checkpoint.rows_done
+    deque(islice(rows, done), maxlen=0)
+
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        valid, errors = validate_chunk(chunk, done + 1)
+        with transaction.atomic():
+            imported = insert_chunk(valid, batch_size)
+            done += len(chunk)
+            ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(rows_done=done, updated_at=timezone.now())
+        yield done, imported, errors
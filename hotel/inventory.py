@@ -0,0 +1,142 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
+
+from .models import Booking, HotelInventory, RoomHold, RoomInventory
+
+
+class NotEnoughRooms(Exception):
+    pass
+
+
+def current_version(hotel_id):
+    inventory, _ = HotelInventory.objects.get_or_create(hotel_id=hotel_id)
+    return inventory.version
+
+
+def current_versions(hotel_ids):
+    versions = dict(HotelInventory.objects.filter(hotel_id__in=hotel_ids).values_list('hotel_id', 'version'))
+    missing = [hotel_id for hotel_id in hotel_ids if hotel_id not in versions]
+    if missing:
+        HotelInventory.objects.bulk_create(
+            [HotelInventory(hotel_id=hotel_id) for hotel_id in missing],
+            ignore_conflicts=True,
+        )
+        versions.update(
+            HotelInventory.objects.filter(hotel_id__in=missing).values_list('hotel_id', 'version')
+        )
+    return versions
+
+
+def claim_version(hotel_id, version):
+    # Compare-and-swap: succeeds only if nobody changed the hotel's
+    # inventory since `version` was read
+    return HotelInventory.objects.filter(
+        hotel_id=hotel_id,
+        version=version,
+    ).update(version=F('version') + 1) == 1
+
+
+def bump_version(hotel_id):
+    if not HotelInventory.objects.filter(hotel_id=hotel_id).update(version=F('version') + 1):
+        HotelInventory.objects.get_or_create(hotel_id=hotel_id, defaults={'version': 1})
+
+
+def stay_nights(check_in, check_out):
+    return [check_in + timedelta(days=i) for i in range((check_out - check_in).days)]
+
+
+def booked_rooms(hotel, check_in, check_out):
+    # Busiest night of the stay decides how many rooms are left; active
+    # holds aren't in the ledger, so they're added night by night
+    holds = RoomHold.objects.active().filter(
+        hotel=hotel,
+        check_in__lt=check_out,
+        check_out__gt=check_in,
+    ).values_list('check_in', 'check_out', 'rooms')
+    if not holds:
+        peak = RoomInventory.objects.filter(
+            hotel=hotel,
+            date__gte=check_in,
+            date__lt=check_out,
+        ).aggregate(peak=Max('rooms_sold'))['peak']
+        return peak or 0
+
+    sold = Counter(dict(
+        RoomInventory.objects.filter(
+            hotel=hotel,
+            date__gte=check_in,
+            date__lt=check_out,
+        ).values_list('date', 'rooms_sold')
+    ))
+    for hold_in, hold_out, rooms in holds:
+        for night in stay_nights(max(hold_in, check_in), min(hold_out, check_out)):
+            sold[night] += rooms
+    return max(sold.values())
+
+
+@transaction.atomic
+def reserve_rooms(hotel, check_in, check_out, rooms):
+    if hotel.total_rooms is None:
+        raise NotEnoughRooms('Not enough rooms available for the selected dates.')
+
+    nights = stay_nights(check_in, check_out)
+    RoomInventory.objects.bulk_create(
+        [RoomInventory(hotel=hotel, date=night) for night in nights],
+        ignore_conflicts=True,
+    )
+    # Only nights that still have room are incremented; anything less than
+    # every night means another booking got there first.
+    updated = RoomInventory.objects.filter(
+        hotel=hotel,
+        date__gte=check_in,
+        date__lt=check_out,
+        rooms_sold__lte=hotel.total_rooms - rooms,
+    ).update(rooms_sold=F('rooms_sold') + rooms)
+
+    if updated != len(nights):
+        raise NotEnoughRooms('Not enough rooms available for the selected dates.')
+
+
+def release_rooms(hotel, check_in, check_out, rooms):
+    # Floored at zero: bookings made outside reserve_rooms (admin, imports)
+    # may never have been counted, and a cancellation mustn't fail on them.
+    # `manage.py rebuild_inventory` recounts the ledger from the bookings.
+    RoomInventory.objects.filter(
+        hotel=hotel,
+        date__gte=check_in,
+        date__lt=check_out,
+    ).update(rooms_sold=Greatest(F('rooms_sold') - rooms, 0))
+
+
+def count_rooms_sold(bookings):
+    sold = Counter()
+    for hotel_id, check_in, check_out, rooms in bookings:
+        for night in stay_nights(check_in, check_out):
+            sold[(hotel_id, night)] += rooms
+    return sold
+
+
+@transaction.atomic
+def rebuild_inventory(hotel_ids=None, batch_size=1000):
+    bookings = Booking.objects.filter(status='booked')
+    ledger = RoomInventory.objects.all()
+    if hotel_ids:
+        bookings = bookings.filter(hotel_id__in=hotel_ids)
+        ledger = ledger.filter(hotel_id__in=hotel_ids)
+
+    ledger.delete()
+    sold = count_rooms_sold(
+        bookings.values_list('hotel_id', 'check_in', 'check_out', 'rooms').iterator()
+    )
+    RoomInventory.objects.bulk_create(
+        [
+            RoomInventory(hotel_id=hotel_id, date=night, rooms_sold=rooms)
+            for (hotel_id, night), rooms in sold.items()
+        ],
+        batch_size=batch_size,
+    )
+    return len(sold)
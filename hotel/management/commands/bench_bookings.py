@@ -0,0 +1,129 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from hotel.booking import BookingError, book_stay
+from hotel.models import CustomUser, Hotel, OutboundEmail, Profile
+
+PROFILES = ('sqlite-basic', 'sqlite', 'postgres')
+
+
+class Command(BaseCommand):
+    help = ('Measure concurrent booking throughput for the configured DB_PROFILE, or compare DB_PROFILEs. '
+            'Every run uses a scratch database, never the configured one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--bookings-per-thread', type=int, default=25)
+        parser.add_argument('--hotels', type=int, default=4)
+        parser.add_argument('--compare', nargs='+', choices=PROFILES,
+                            help='Run the benchmark once per profile, each SQLite run on a fresh database file.')
+        parser.add_argument('--postgres-url',
+                            help='Throwaway database for the postgres profile; it is migrated and written to.')
+        # Set on the child process that runs inside the scratch database
+        parser.add_argument('--scratch', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if not options['scratch']:
+            return self.compare(options['compare'] or [settings.DB_PROFILE], options)
+
+        run = uuid.uuid4().hex[:8]
+        hotels = [
+            Hotel.objects.create(
+                name=f'Benchmark {run} {i}', address='-', description='-',
+                total_rooms=options['threads'] * options['bookings_per_thread'], price_per_night=1,
+            )
+            for i in range(options['hotels'])
+        ]
+        users = []
+        for i in range(options['threads']):
+            user = CustomUser.objects.create(email=f'bench-{run}-{i}@example.com')
+            Profile.objects.create(user=user, wallet_balance=10 ** 6, phone_number='')
+            users.append(user)
+
+        try:
+            booked, failed, elapsed = self.book_concurrently(users, hotels, options['bookings_per_thread'])
+        finally:
+            # A postgres scratch database may be reused, so leave it empty
+            Hotel.objects.filter(id__in=[hotel.id for hotel in hotels]).delete()
+            CustomUser.objects.filter(id__in=[user.id for user in users]).delete()
+            OutboundEmail.objects.filter(to__in=[user.email for user in users]).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{settings.DB_PROFILE} ({connection.settings_dict['NAME']}): {booked} bookings in {elapsed:.2f}s "
+            f"({booked / elapsed:.1f} bookings/sec, {failed} failed)"
+        ))
+
+    def book_concurrently(self, users, hotels, per_thread):
+        barrier = threading.Barrier(len(users))
+        outcomes = []
+        check_in = date.today() + timedelta(days=30)
+
+        def worker(i, user):
+            barrier.wait()
+            try:
+                for n in range(per_thread):
+                    # Threads share hotels, so they contend on the same inventory
+                    hotel = hotels[(i + n) % len(hotels)]
+                    stay_in = check_in + timedelta(days=n % 7)
+                    try:
+                        book_stay(user, hotel, stay_in, stay_in + timedelta(days=2))
+                        outcomes.append(True)
+                    except BookingError:
+                        outcomes.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i, user)) for i, user in enumerate(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes.count(True), outcomes.count(False), time.perf_counter() - started
+
+    def compare(self, profiles, options):
+        # Never benchmark the configured database: the run migrates and
+        # writes rows, so each SQLite run gets a fresh file and postgres
+        # needs an explicit scratch database
+        postgres_url = options['postgres_url']
+        if 'postgres' in profiles:
+            if not postgres_url:
+                raise CommandError('The postgres profile needs --postgres-url pointing at a throwaway database.')
+            if postgres_url == os.environ.get('DATABASE_URL'):
+                raise CommandError('--postgres-url must not be the configured DATABASE_URL.')
+
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        arguments = [
+            '--threads', str(options['threads']),
+            '--bookings-per-thread', str(options['bookings_per_thread']),
+            '--hotels', str(options['hotels']),
+            '--scratch',
+        ]
+        for profile in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                env = {**os.environ, 'DB_PROFILE': profile, 'SQLITE_PATH': os.path.join(directory, 'bench.sqlite3')}
+                if profile == 'sqlite':
+                    # A scratch file, so the tuned profile can use WAL
+                    env['SQLITE_JOURNAL_MODE'] = 'WAL'
+                if profile == 'postgres':
+                    env['DATABASE_URL'] = postgres_url
+                for command in (['migrate', '--noinput', '-v', '0'], ['bench_bookings', *arguments]):
+                    result = subprocess.run([sys.executable, manage, *command], env=env, capture_output=True, text=True)
+                    if result.returncode:
+                        raise CommandError(f'{profile}: {result.stderr.strip()}')
+                output = result.stdout.strip()
+                # The run reports the profile it actually used
+                if not output.startswith(f'{profile} ('):
+                    raise CommandError(f'{profile}: the benchmark ran with a different setup: {output}')
+                self.stdout.write(output)
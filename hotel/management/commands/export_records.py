@@ -0,0 +1,30 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from hotel.export import EXPORTS, export_lines, export_queryset
+
+
+class Command(BaseCommand):
+    help = 'Stream every booking or transaction to a CSV or JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', dest='fmt', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--start', type=date.fromisoformat, help='First creation date to include (YYYY-MM-DD).')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last creation date to include (YYYY-MM-DD).')
+        parser.add_argument('--output', help='File to write; defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        queryset = export_queryset(options['kind'], start=options['start'], end=options['end'])
+        lines = export_lines(options['kind'], queryset, options['fmt'], options['chunk_size'])
+        if not options['output']:
+            for block in lines:
+                self.stdout.write(block, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+            for block in lines:
+                f.write(block)
+        self.stderr.write(self.style.SUCCESS(f"Exported {options['kind']} to {options['output']}."))
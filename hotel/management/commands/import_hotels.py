@@ -0,0 +1,43 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hotel.importer import import_hotels
+
+
+class Command(BaseCommand):
+    help = 'Stream hotels and their image references from a CSV or JSONL file into the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='fmt', choices=['csv', 'jsonl'],
+                            help='Input format; defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--source', help='Checkpoint name; defaults to the file path.')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and import from the first row.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist.')
+        fmt = options['fmt'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        source = options['source'] or os.path.abspath(path)
+
+        started = time.perf_counter()
+        rows = total_imported = total_rejected = 0
+        for done, imported, errors in import_hotels(
+            path, fmt, options['batch_size'], source, options['restart']
+        ):
+            rows += imported + len(errors)
+            total_imported += imported
+            total_rejected += len(errors)
+            for row_number, detail in errors:
+                self.stderr.write(f'Row {row_number}: {detail}')
+            rate = rows / (time.perf_counter() - started)
+            self.stdout.write(f'{done} rows done, {total_imported} hotels imported ({rate:.0f} rows/sec)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total_imported} hotels, rejected {total_rejected} rows '
+            f'in {time.perf_counter() - started:.1f}s.'
+        ))
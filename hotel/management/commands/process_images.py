@@ -0,0 +1,30 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from hotel.images import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Create resized WebP/JPEG variants for new and existing hotel images in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Rendering processes; 0 renders in this process.')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new uploads instead of exiting.')
+        parser.add_argument('--interval', type=float, default=10.0, help='Seconds to wait between polls in --loop mode.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            processed, failed = process_pending(options['batch_size'], options['workers'])
+            if processed or failed:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Processed {processed} images, {failed} unreadable, '
+                    f'in {time.perf_counter() - started:.1f}s.'
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
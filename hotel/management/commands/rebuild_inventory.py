@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from hotel.inventory import rebuild_inventory
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-night room inventory ledger from existing bookings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotel', type=int, action='append', dest='hotels',
+                            help='Only rebuild the given hotel id (can be repeated).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = rebuild_inventory(options['hotels'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} inventory rows.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from hotel.review_stats import recompute_review_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized review statistics stored on each hotel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotel', type=int, action='append', dest='hotels',
+                            help='Only recompute the given hotel id (can be repeated).')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        hotels = recompute_review_stats(options['hotels'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed review stats for {hotels} hotels.'))
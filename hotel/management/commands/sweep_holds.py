@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from hotel.models import RoomHold
+
+
+class Command(BaseCommand):
+    help = 'Delete expired room holds in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting after one pass.')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds to wait between sweeps in --loop mode.')
+
+    def handle(self, *args, **options):
+        while True:
+            # Expired holds already stopped counting towards availability, so
+            # this is cleanup only. RoomHold has no dependents or delete
+            # signals, which keeps it to a single DELETE statement.
+            deleted, _ = RoomHold.objects.filter(expires_at__lte=timezone.now()).delete()
+            self.stdout.write(self.style.SUCCESS(f'Swept {deleted} expired holds.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from hotel.wallet import create_checkpoints
+
+
+class Command(BaseCommand):
+    help = 'Checkpoint wallet ledger balances and report wallets that disagree with the ledger.'
+
+    def handle(self, *args, **options):
+        mismatched = create_checkpoints()
+        for user_id, ledger, profile in mismatched:
+            self.stdout.write(self.style.WARNING(
+                f'User {user_id}: ledger balance {ledger} but profile balance {profile}'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Checkpoints written; {len(mismatched)} wallet(s) out of step with the ledger.'
+        ))
@@ -1,4 +1,10 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import connections, models
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .utils import normalize_location
 
 class CustomUserManager(BaseUserManager):
     def create_superuser(self, email, password, **extra_fields):
@@ -9,4 +15,84 @@ class CustomUserManager(BaseUserManager):
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
         user.save()
-        return user
\ No newline at end of file
+        return user
+
+
+class HotelQuerySet(models.QuerySet):
+    def location_prefix(self, query):
+        key = normalize_location(query)
+        if connections[self.db].vendor == 'postgresql':
+            # db_index on location_key also creates a varchar_pattern_ops index
+            # there, which serves LIKE 'key%'
+            return self.filter(location_key__startswith=key)
+        # Binary-ordered index range scan for everything starting with key
+        return self.filter(location_key__gte=key, location_key__lt=key + '\U0010ffff')
+
+    def with_availability(self, check_in, check_out):
+        # Busiest night of the stay per hotel, read from the inventory ledger.
+        # Active holds aren't in the ledger; adding every hold that overlaps
+        # the stay over-counts them when they fall on different nights, which
+        # is safe for this fallback path.
+        from .models import RoomHold, RoomInventory
+
+        peak = (
+            RoomInventory.objects.filter(
+                hotel=OuterRef('pk'),
+                date__gte=check_in,
+                date__lt=check_out,
+            )
+            .order_by()
+            .values('hotel')
+            .annotate(peak=Max('rooms_sold'))
+            .values('peak')
+        )
+        held = (
+            RoomHold.objects.active()
+            .filter(hotel=OuterRef('pk'), check_in__lt=check_out, check_out__gt=check_in)
+            .order_by()
+            .values('hotel')
+            .annotate(held=Sum('rooms'))
+            .values('held')
+        )
+        return self.annotate(
+            booked_rooms=Coalesce(Subquery(peak), 0) + Coalesce(Subquery(held), 0),
+        ).annotate(
+            free_rooms=F('total_rooms') - F('booked_rooms'),
+        )
+
+    def fits_guests(self, adults, children, rooms_requested):
+        guests = adults + children
+        # Smallest room capacity that still fits every guest in the requested rooms
+        min_capacity = -(-guests // rooms_requested)
+        return self.filter(total_rooms__isnull=False, capacity_per_room__gte=min_capacity)
+
+    def available_for(self, check_in, check_out, adults, children, rooms_requested):
+        return self.fits_guests(adults, children, rooms_requested).with_availability(
+            check_in, check_out,
+        ).filter(free_rooms__gte=rooms_requested)
+
+    def with_inventory_version(self):
+        return self.annotate(inventory_version=Coalesce(F('inventory__version'), 0))
+
+    def with_first_image(self):
+        from .models import HotelImage
+
+        first_image = HotelImage.objects.filter(hotel=OuterRef('pk')).order_by('pk')
+        return self.annotate(
+            first_image=Subquery(first_image.values('image')[:1]),
+            first_image_variants=Subquery(first_image.values('variants')[:1], output_field=models.JSONField()),
+        )
+
+    def for_listing(self, fields=None):
+        # Everything HotelSerializer reads: rating stats are plain columns and
+        # the first image comes from a subquery, so serializing N hotels
+        # costs a single query. With `fields` (as passed to the serializer)
+        # the subquery is only added when the image is asked for.
+        if fields is not None and 'image' not in fields:
+            return self
+        return self.with_first_image()
+
+
+class RoomHoldQuerySet(models.QuerySet):
+    def active(self, now=None):
+        return self.filter(expires_at__gt=now or timezone.now())
@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Files named after their sha256 (hotel.images) never change content
+HASHED_NAME = re.compile(r'(?:^|/)([0-9a-f]{64}(?:-[a-z]+)?)\.[a-z0-9]+$')
+BYTE_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange:
+    # Read-only view of `length` bytes from the file's current position.
+    # fileno() is kept so a WSGI server's file_wrapper (gunicorn, uWSGI) can
+    # still sendfile() exactly Content-Length bytes from that offset.
+    def __init__(self, f, length):
+        self.file = f
+        self.name = f.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    # Returns the inclusive (start, end) of a single byte range, or None
+    # when the header should be ignored (malformed or multiple ranges) and
+    # the whole file served instead
+    match = BYTE_RANGE.fullmatch(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def sendfile_response(path, full_path):
+    # The front-end server reads the file, handles Range itself and sends
+    # it with sendfile; Django only answers with headers
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    response = HttpResponse()
+    response['Content-Type'] = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_SENDFILE_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(path)
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+
+def file_response(request, full_path, size, etag, last_modified):
+    requested = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if requested and if_range and if_range not in (etag, http_date(last_modified)):
+        requested = None
+
+    try:
+        byte_range = parse_range(requested, size) if requested else None
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    f = open(full_path, 'rb')
+    if byte_range is None:
+        return FileResponse(f)
+
+    start, end = byte_range
+    f.seek(start)
+    response = FileResponse(FileRange(f, end - start + 1), status=206)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def serve_media(request, path):
+    # Production media handler: conditional GET, byte ranges, long-lived
+    # caching for content-hashed names, and the body left to the server's
+    # sendfile either through wsgi.file_wrapper or MEDIA_SENDFILE headers.
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File not found')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('File not found')
+
+    hashed = HASHED_NAME.search(path)
+    if hashed:
+        etag = f'"{hashed.group(1)}"'
+        cache_control = IMMUTABLE
+    else:
+        etag = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+        cache_control = f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+    last_modified = int(file_stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if getattr(settings, 'MEDIA_SENDFILE', None):
+            response = sendfile_response(path, full_path)
+        else:
+            response = file_response(request, full_path, file_stat.st_size, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    return response
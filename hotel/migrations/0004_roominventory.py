@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:36
+
+import django.db.models.deletion
+from collections import Counter
+from datetime import timedelta
+from django.db import migrations, models
+
+
+def populate_inventory(apps, schema_editor):
+    Booking = apps.get_model('hotel', 'Booking')
+    RoomInventory = apps.get_model('hotel', 'RoomInventory')
+
+    sold = Counter()
+    bookings = Booking.objects.filter(status='booked').values_list('hotel_id', 'check_in', 'check_out', 'rooms')
+    for hotel_id, check_in, check_out, rooms in bookings.iterator():
+        for i in range((check_out - check_in).days):
+            sold[(hotel_id, check_in + timedelta(days=i))] += rooms
+
+    RoomInventory.objects.bulk_create(
+        [RoomInventory(hotel_id=hotel_id, date=night, rooms_sold=rooms) for (hotel_id, night), rooms in sold.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0003_remove_hotel_city_hotel_available_rooms_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('rooms_sold', models.PositiveIntegerField(default=0)),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', to='hotel.hotel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('hotel', 'date'), name='unique_hotel_inventory_date')],
+            },
+        ),
+        migrations.RunPython(populate_inventory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+from hotel.utils import normalize_location
+
+
+def populate_location_key(apps, schema_editor):
+    Hotel = apps.get_model('hotel', 'Hotel')
+    hotels = list(Hotel.objects.only('id', 'location'))
+    for hotel in hotels:
+        hotel.location_key = normalize_location(hotel.location)
+    Hotel.objects.bulk_update(hotels, ['location_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0004_roominventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotel',
+            name='location_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(populate_location_key, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0005_hotel_location_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['created_at', 'id'], name='hotel_created_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:40
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def populate_review_stats(apps, schema_editor):
+    Hotel = apps.get_model('hotel', 'Hotel')
+    Review = apps.get_model('hotel', 'Review')
+    fields = ['review_count', 'rating_sum', 'rating_max'] + [f'ratings_{rating}' for rating in range(1, 6)]
+
+    stats = Review.objects.order_by().values('hotel_id').annotate(
+        review_count=Count('id'),
+        rating_sum=Sum('rating'),
+        rating_max=Max('rating'),
+        **{f'ratings_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)},
+    )
+    Hotel.objects.bulk_update([Hotel(pk=row.pop('hotel_id'), **row) for row in stats], fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0006_hotel_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotel',
+            name='rating_max',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='ratings_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='ratings_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='ratings_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='ratings_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='ratings_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_review_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0007_hotel_review_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelInventory',
+            fields=[
+                ('hotel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inventory', serialize=False, to='hotel.hotel')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def open_wallet_ledgers(apps, schema_editor):
+    # Existing balances become each wallet's opening checkpoint
+    Profile = apps.get_model('hotel', 'Profile')
+    Transaction = apps.get_model('hotel', 'Transaction')
+    WalletCheckpoint = apps.get_model('hotel', 'WalletCheckpoint')
+
+    last_ids = dict(Transaction.objects.values('user_id').annotate(last_id=Max('id')).values_list('user_id', 'last_id'))
+    WalletCheckpoint.objects.bulk_create(
+        [
+            WalletCheckpoint(user_id=user_id, balance=balance, last_transaction_id=last_ids.get(user_id))
+            for user_id, balance in Profile.objects.values_list('user_id', 'wallet_balance')
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0008_hotelinventory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='hotel.transaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_checkpoints', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(open_wallet_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:49
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0010_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('check_in', models.DateField()),
+                ('check_out', models.DateField()),
+                ('adults', models.PositiveIntegerField(default=1)),
+                ('children', models.PositiveIntegerField(default=0)),
+                ('rooms', models.PositiveIntegerField(default=1)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_holds', to='hotel.hotel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_holds', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hotel', 'expires_at'], name='roomhold_hotel_expiry_idx'), models.Index(fields=['expires_at'], name='roomhold_expiry_idx')],
+            },
+        ),
+    ]
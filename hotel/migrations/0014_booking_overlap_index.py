@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0013_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('status', 'booked')), fields=['hotel', 'check_out', 'check_in', 'rooms', 'status'], name='booking_live_overlap_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0014_booking_overlap_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotelimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='hotelimage',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='hotelimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='hotelimage',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='hotelimage_pending_idx'),
+        ),
+    ]
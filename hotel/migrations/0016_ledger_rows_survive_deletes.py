@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_marks(apps, schema_editor):
+    WalletCheckpoint = apps.get_model('hotel', 'WalletCheckpoint')
+    for checkpoint in WalletCheckpoint.objects.exclude(last_transaction=None).iterator():
+        WalletCheckpoint.objects.filter(pk=checkpoint.pk).update(last_transaction_mark=checkpoint.last_transaction_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotel', '0015_hotelimage_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='booking',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='hotel.booking'),
+        ),
+        migrations.AddField(
+            model_name='walletcheckpoint',
+            name='last_transaction_mark',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_marks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='walletcheckpoint',
+            name='last_transaction',
+        ),
+        migrations.RenameField(
+            model_name='walletcheckpoint',
+            old_name='last_transaction_mark',
+            new_name='last_transaction_id',
+        ),
+    ]
@@ -1,6 +1,10 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from .manager import CustomUserManager
+from django.utils import timezone
+from .manager import CustomUserManager, HotelQuerySet, RoomHoldQuerySet
+from .utils import normalize_location
 
 # Create your models here.
 class CustomUser(AbstractUser):
@@ -32,6 +36,7 @@ class Hotel(models.Model):
     name = models.CharField(max_length=100)
     address = models.TextField()
     location = models.CharField(max_length=50, blank=True, null=True)
+    location_key = models.CharField(max_length=100, blank=True, default='', db_index=True, editable=False)
     description = models.TextField()
     total_rooms = models.PositiveIntegerField(blank=True, null=True)
     available_rooms = models.PositiveIntegerField( blank=True, null=True)
@@ -39,16 +44,72 @@ class Hotel(models.Model):
     price_per_night = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Review statistics, kept in step with Review by hotel.review_stats
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_max = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    ratings_1 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_2 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_3 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_4 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    STATS_FIELDS = ['review_count', 'rating_sum', 'rating_max'] + [f'ratings_{rating}' for rating in range(1, 6)]
+
+    objects = HotelQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='hotel_created_at_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        self.location_key = normalize_location(self.location)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'location' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'location_key'}
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # The review stats only move through hotel.review_stats, so a
+            # full save (API, admin) never writes back the values it loaded
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STATS_FIELDS
+            ]
+        super().save(*args, **kwargs)
     
 class HotelImage(models.Model):
     hotel = models.ForeignKey(Hotel, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='hotel_images/')
     alt_text = models.CharField(max_length=255, blank=True)
+
+    # Filled in by hotel.images: sha256 of the original, and the storage
+    # names of its resized copies as {variant: {format: name}}
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    processed_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='hotelimage_pending_idx'),
+        ]
+
     def __str__(self):
         return f"Image for {self.hotel.name}"
 
+class ImportCheckpoint(models.Model):
+    # Rows of an import source already committed, updated in the same
+    # transaction as each batch so `manage.py import_hotels` resumes without
+    # duplicating hotels
+    source = models.CharField(max_length=255, unique=True)
+    rows_done = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source}: {self.rows_done} rows"
+
 class Booking(models.Model):
     user = models.ForeignKey(CustomUser, related_name='bookings', on_delete=models.CASCADE)
     hotel = models.ForeignKey(Hotel, related_name='bookings', on_delete=models.CASCADE)
@@ -61,9 +122,71 @@ class Booking(models.Model):
     status = models.CharField(max_length=20, choices=[('booked', 'Booked'), ('cancelled', 'Cancelled')], default='booked')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Backs the keyset-paginated booking history
+            models.Index(fields=['user', 'created_at', 'id'], name='booking_user_created_idx'),
+            # Overlap lookups (check_in < end AND check_out > start) over live
+            # bookings. check_out leads the range so only stays that haven't
+            # ended yet are visited; rooms and status are carried so the
+            # lookup never touches the table.
+            models.Index(
+                fields=['hotel', 'check_out', 'check_in', 'rooms', 'status'],
+                condition=models.Q(status='booked'),
+                name='booking_live_overlap_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Booking by {self.user.email} at {self.hotel.name}"
     
+class RoomInventory(models.Model):
+    hotel = models.ForeignKey(Hotel, related_name='room_nights', on_delete=models.CASCADE)
+    date = models.DateField()
+    rooms_sold = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hotel', 'date'], name='unique_hotel_inventory_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.hotel.name} on {self.date}: {self.rooms_sold} sold"
+
+class RoomHold(models.Model):
+    # Rooms set aside between search and payment. Holds count towards
+    # availability until expires_at and are removed by `manage.py sweep_holds`
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(CustomUser, related_name='room_holds', on_delete=models.CASCADE)
+    hotel = models.ForeignKey(Hotel, related_name='room_holds', on_delete=models.CASCADE)
+    check_in = models.DateField()
+    check_out = models.DateField()
+    adults = models.PositiveIntegerField(default=1)
+    children = models.PositiveIntegerField(default=0)
+    rooms = models.PositiveIntegerField(default=1)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = RoomHoldQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hotel', 'expires_at'], name='roomhold_hotel_expiry_idx'),
+            models.Index(fields=['expires_at'], name='roomhold_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"Hold on {self.rooms} rooms at {self.hotel.name} until {self.expires_at}"
+
+class HotelInventory(models.Model):
+    # Bumped by every change to a hotel's bookings; writers compare-and-swap
+    # on it so bookings for the same hotel never interleave
+    hotel = models.OneToOneField(Hotel, related_name='inventory', on_delete=models.CASCADE, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.hotel.name} inventory v{self.version}"
+
 class Review(models.Model):
     user = models.ForeignKey(CustomUser, related_name='reviews', on_delete=models.CASCADE)
     hotel = models.ForeignKey(Hotel, related_name='reviews', on_delete=models.CASCADE)
@@ -77,10 +200,63 @@ class Review(models.Model):
     
 class Transaction(models.Model):
     user = models.ForeignKey(CustomUser, related_name='transactions', on_delete=models.CASCADE)
-    booking = models.ForeignKey(Booking, related_name='transactions', null=True, blank=True, on_delete=models.CASCADE)
+    # Ledger rows outlive the booking (or hotel) they paid for
+    booking = models.ForeignKey(Booking, related_name='transactions', null=True, blank=True, on_delete=models.SET_NULL)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_type = models.CharField(max_length=20, choices=[('Deposit', 'Deposit'), ('Booking Payment', 'Booking Payment'), ('Refund', 'Refund')])
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Backs the keyset-paginated transaction history
+            models.Index(fields=['user', 'created_at', 'id'], name='transaction_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_type.title()} of {self.amount} for {self.user.email}"
+
+    def save(self, *args, **kwargs):
+        # The transaction table is the wallet's append-only ledger
+        if not self._state.adding:
+            raise ValueError('Transactions are append-only and cannot be changed.')
+        super().save(*args, **kwargs)
+
+
+class WalletCheckpoint(models.Model):
+    # Ledger balance as of the transaction with id `last_transaction_id`,
+    # so rebuilding a balance only sums the transactions recorded after it.
+    # A plain id rather than a foreign key: the mark must not move or
+    # vanish if that row ever goes away.
+    user = models.ForeignKey(CustomUser, related_name='wallet_checkpoints', on_delete=models.CASCADE)
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_transaction_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Wallet checkpoint of {self.balance} for {self.user.email}"
+
+
+class OutboundEmail(models.Model):
+    # Outbox written in the same transaction as the change it reports on and
+    # drained by `manage.py send_outbox`
+    STATUS_CHOICES = [('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')]
+
+    to = models.EmailField()
+    from_email = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=10, default='plain')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.transaction_type.title()} of {self.amount} for {self.user.email}"
\ No newline at end of file
+        return f"{self.subject} to {self.to} ({self.status})"
@@ -0,0 +1,321 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict, deque
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import DateTimeField, Value
+from django.utils import timezone
+
+from .models import Booking, RoomHold, RoomInventory
+
+
+class OccupancyIndexUnavailable(Exception):
+    pass
+
+
+def overlapping_stays(hotel_ids, start, end):
+    # Booked stays and active holds both take rooms
+    bookings = Booking.objects.filter(
+        hotel_id__in=hotel_ids,
+        check_in__lt=end,
+        check_out__gt=start,
+        status='booked',
+    ).values_list('hotel_id', 'check_in', 'check_out', 'rooms')
+    holds = RoomHold.objects.active().filter(
+        hotel_id__in=hotel_ids,
+        check_in__lt=end,
+        check_out__gt=start,
+    ).values_list('hotel_id', 'check_in', 'check_out', 'rooms')
+    return bookings.union(holds, all=True)
+
+
+def nightly_occupancy(stays, start, end):
+    # Sweep line: +rooms on the first night, -rooms on check-out, then a
+    # running sum gives the rooms occupied on every night in [start, end).
+    days = (end - start).days
+    changes = [0] * (days + 1)
+    for check_in, check_out, rooms in stays:
+        lo = max((check_in - start).days, 0)
+        hi = min((check_out - start).days, days)
+        if lo < hi:
+            changes[lo] += rooms
+            changes[hi] -= rooms
+
+    occupancy = []
+    running = 0
+    for change in changes[:days]:
+        running += change
+        occupancy.append(running)
+    return occupancy
+
+
+def window_peaks(values, width):
+    # Sliding-window maximum with a monotonic deque, O(len(values)) overall
+    peaks = []
+    window = deque()
+    for i, value in enumerate(values):
+        while window and values[window[-1]] <= value:
+            window.pop()
+        window.append(i)
+        if window[0] <= i - width:
+            window.popleft()
+        if i >= width - 1:
+            peaks.append(values[window[0]])
+    return peaks
+
+
+def flexible_availability(hotels, check_in, check_out, flex_days, rooms_requested):
+    # Free rooms for every start date within +/- flex_days of check_in that
+    # can still fit rooms_requested, keyed by hotel id.
+    stay_length = (check_out - check_in).days
+    first_start = max(check_in - timedelta(days=flex_days), date.today())
+    last_start = check_in + timedelta(days=flex_days)
+    span_end = last_start + timedelta(days=stay_length)
+
+    stays_by_hotel = defaultdict(list)
+    for hotel_id, stay_in, stay_out, rooms in overlapping_stays([h.id for h in hotels], first_start, span_end):
+        stays_by_hotel[hotel_id].append((stay_in, stay_out, rooms))
+
+    availability = {}
+    for hotel in hotels:
+        occupancy = nightly_occupancy(stays_by_hotel[hotel.id], first_start, span_end)
+        windows = []
+        for offset, peak in enumerate(window_peaks(occupancy, stay_length)):
+            free_rooms = hotel.total_rooms - peak
+            if free_rooms >= rooms_requested:
+                windows.append((first_start + timedelta(days=offset), free_rooms))
+        availability[hotel.id] = windows
+    return availability
+
+
+class OccupancyTree:
+    # Segment tree over the nights [start, start + days) supporting
+    # "add rooms to a stay" and "busiest night of a stay" in O(log n).
+
+    def __init__(self, start, days):
+        self.start = start
+        self.days = days
+        self.size = 1
+        while self.size < days:
+            self.size *= 2
+        self.peak = array('l', [0]) * (2 * self.size)
+        self.pending = array('l', [0]) * (2 * self.size)
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=self.days)
+
+    def covers(self, check_in, check_out):
+        return self.start <= check_in and check_out <= self.end
+
+    def _offsets(self, check_in, check_out):
+        lo = max((check_in - self.start).days, 0)
+        hi = min((check_out - self.start).days, self.days) - 1
+        return lo, hi
+
+    def add(self, check_in, check_out, rooms):
+        lo, hi = self._offsets(check_in, check_out)
+        if lo <= hi:
+            self._add(1, 0, self.size - 1, lo, hi, rooms)
+
+    def max(self, check_in, check_out):
+        lo, hi = self._offsets(check_in, check_out)
+        if lo > hi:
+            return 0
+        return self._max(1, 0, self.size - 1, lo, hi)
+
+    def _add(self, node, node_lo, node_hi, lo, hi, rooms):
+        if hi < node_lo or node_hi < lo:
+            return
+        if lo <= node_lo and node_hi <= hi:
+            self.peak[node] += rooms
+            self.pending[node] += rooms
+            return
+        mid = (node_lo + node_hi) // 2
+        self._add(2 * node, node_lo, mid, lo, hi, rooms)
+        self._add(2 * node + 1, mid + 1, node_hi, lo, hi, rooms)
+        self.peak[node] = self.pending[node] + max(self.peak[2 * node], self.peak[2 * node + 1])
+
+    def _max(self, node, node_lo, node_hi, lo, hi):
+        if hi < node_lo or node_hi < lo:
+            return float('-inf')
+        if lo <= node_lo and node_hi <= hi:
+            return self.peak[node]
+        mid = (node_lo + node_hi) // 2
+        return self.pending[node] + max(
+            self._max(2 * node, node_lo, mid, lo, hi),
+            self._max(2 * node + 1, mid + 1, node_hi, lo, hi),
+        )
+
+
+class OccupancyIndex:
+    # Process-local occupancy per hotel, loaded lazily from Booking and the
+    # active holds and kept current by the Booking signals. Lookups that
+    # pass the hotel's inventory version reload any tree loaded at a
+    # different version, and entries also expire after a TTL or when the
+    # first hold in them runs out; callers fall back to the SQL path
+    # whenever a lookup raises OccupancyIndexUnavailable.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._trees = OrderedDict()
+        # Bumped by every apply() and invalidate(), so a load that raced with
+        # a change knows its tree may have missed it
+        self._generations = defaultdict(int)
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'OCCUPANCY_INDEX_ENABLED', True)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'OCCUPANCY_INDEX_TTL', 60)
+
+    @property
+    def horizon_days(self):
+        return getattr(settings, 'OCCUPANCY_INDEX_HORIZON_DAYS', 730)
+
+    @property
+    def max_hotels(self):
+        return getattr(settings, 'OCCUPANCY_INDEX_MAX_HOTELS', 2000)
+
+    def clear(self):
+        with self._lock:
+            self._trees.clear()
+
+    def invalidate(self, hotel_id):
+        with self._lock:
+            self._generations[hotel_id] += 1
+            self._trees.pop(hotel_id, None)
+
+    def _fresh_tree(self, hotel_id, now, version):
+        entry = self._trees.get(hotel_id)
+        if entry is None:
+            return None
+        tree, loaded_at, loaded_version, holds_expire = entry
+        stale = version is not None and version != loaded_version
+        if holds_expire is not None and timezone.now() >= holds_expire:
+            stale = True
+        if stale or now - loaded_at > self.ttl or tree.start != date.today():
+            del self._trees[hotel_id]
+            return None
+        self._trees.move_to_end(hotel_id)
+        return tree
+
+    def load(self, hotel_ids, versions=None):
+        # Build trees for every hotel that is not cached yet with one query.
+        # A tree is only installed if no change was applied to its hotel
+        # while the query ran; otherwise it is used for this lookup only.
+        with self._lock:
+            generations = {hotel_id: self._generations[hotel_id] for hotel_id in hotel_ids}
+        start = date.today()
+        trees = {hotel_id: OccupancyTree(start, self.horizon_days) for hotel_id in hotel_ids}
+        holds_expire = dict.fromkeys(hotel_ids)
+        bookings = Booking.objects.filter(
+            hotel_id__in=hotel_ids,
+            check_out__gt=start,
+            status='booked',
+        ).values_list('hotel_id', 'check_in', 'check_out', 'rooms', Value(None, output_field=DateTimeField()))
+        holds = RoomHold.objects.active().filter(
+            hotel_id__in=hotel_ids,
+            check_out__gt=start,
+        ).values_list('hotel_id', 'check_in', 'check_out', 'rooms', 'expires_at')
+        for hotel_id, check_in, check_out, rooms, expires_at in bookings.union(holds, all=True).iterator():
+            trees[hotel_id].add(check_in, check_out, rooms)
+            if expires_at is not None and (holds_expire[hotel_id] is None or expires_at < holds_expire[hotel_id]):
+                holds_expire[hotel_id] = expires_at
+
+        loaded_at = time.monotonic()
+        with self._lock:
+            for hotel_id, tree in trees.items():
+                if self._generations[hotel_id] != generations[hotel_id]:
+                    continue
+                self._trees[hotel_id] = (tree, loaded_at, (versions or {}).get(hotel_id), holds_expire[hotel_id])
+                self._trees.move_to_end(hotel_id)
+            while len(self._trees) > self.max_hotels:
+                self._trees.popitem(last=False)
+        return trees
+
+    def peaks(self, hotel_ids, check_in, check_out, versions=None):
+        if not self.enabled:
+            raise OccupancyIndexUnavailable('Occupancy index is disabled.')
+
+        now = time.monotonic()
+        trees = {}
+        with self._lock:
+            for hotel_id in hotel_ids:
+                tree = self._fresh_tree(hotel_id, now, (versions or {}).get(hotel_id))
+                if tree is not None:
+                    trees[hotel_id] = tree
+        missing = [hotel_id for hotel_id in hotel_ids if hotel_id not in trees]
+        if missing:
+            trees.update(self.load(missing, versions))
+
+        peaks = {}
+        with self._lock:
+            for hotel_id, tree in trees.items():
+                if not tree.covers(check_in, check_out):
+                    raise OccupancyIndexUnavailable('Stay is outside the indexed horizon.')
+                peaks[hotel_id] = tree.max(check_in, check_out)
+        return peaks
+
+    def peak(self, hotel_id, check_in, check_out, version=None):
+        versions = None if version is None else {hotel_id: version}
+        return self.peaks([hotel_id], check_in, check_out, versions)[hotel_id]
+
+    def advance(self, hotel_id, old_version, new_version):
+        # This process made the change (and applied it through the signals),
+        # so a tree loaded at old_version is still exact at new_version
+        with self._lock:
+            entry = self._trees.get(hotel_id)
+            if entry is not None and entry[2] == old_version:
+                self._trees[hotel_id] = (entry[0], entry[1], new_version, entry[3])
+
+    def apply(self, hotel_id, check_in, check_out, rooms, expires_at=None):
+        # expires_at is set for holds, whose rooms only count until then
+        with self._lock:
+            self._generations[hotel_id] += 1
+            entry = self._trees.get(hotel_id)
+            if entry is not None:
+                entry[0].add(check_in, check_out, rooms)
+                if expires_at is not None and (entry[3] is None or expires_at < entry[3]):
+                    self._trees[hotel_id] = (*entry[:3], expires_at)
+
+    def verify(self, hotel_id):
+        # Compare every indexed night against the inventory ledger plus the
+        # active holds and drop the tree if they disagree, so the next lookup
+        # reloads it.
+        with self._lock:
+            entry = self._trees.get(hotel_id)
+        if entry is None:
+            return True
+        tree = entry[0]
+        ledger = dict(
+            RoomInventory.objects.filter(
+                hotel_id=hotel_id,
+                date__gte=tree.start,
+                date__lt=tree.end,
+            ).values_list('date', 'rooms_sold')
+        )
+        held = nightly_occupancy(
+            RoomHold.objects.active().filter(
+                hotel_id=hotel_id,
+                check_in__lt=tree.end,
+                check_out__gt=tree.start,
+            ).values_list('check_in', 'check_out', 'rooms'),
+            tree.start, tree.end,
+        )
+        nights = [tree.start + timedelta(days=i) for i in range(tree.days)]
+        with self._lock:
+            consistent = all(
+                tree.max(night, night + timedelta(days=1)) == ledger.get(night, 0) + held[i]
+                for i, night in enumerate(nights)
+            )
+        if not consistent:
+            self.invalidate(hotel_id)
+        return consistent
+
+
+occupancy_index = OccupancyIndex()
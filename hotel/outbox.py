@@ -0,0 +1,123 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+def enqueue_email(to, subject, body, content_subtype='plain'):
+    return OutboundEmail.objects.create(
+        to=to,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        subject=subject,
+        body=body,
+        content_subtype=content_subtype,
+    )
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'OUTBOX_RETRY_BASE_SECONDS', 30)
+    maximum = getattr(settings, 'OUTBOX_RETRY_MAX_SECONDS', 3600)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), maximum))
+
+
+def as_message(email, connection):
+    message = EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=[email.to],
+        connection=connection,
+    )
+    message.content_subtype = email.content_subtype
+    return message
+
+
+def claim_batch(batch_size):
+    # Short transaction: pick the due emails and push next_attempt_at past
+    # the time a send can take, so no other worker picks them up meanwhile.
+    # If this worker dies mid-batch the lease runs out and they are retried.
+    lease = timedelta(seconds=getattr(settings, 'OUTBOX_CLAIM_SECONDS', 300))
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if batch:
+            OutboundEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                next_attempt_at=timezone.now() + lease
+            )
+    return batch
+
+
+def record_failure(email, error, max_attempts):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= max_attempts:
+        email.status = 'failed'
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+
+
+def save_results(batch):
+    with transaction.atomic():
+        OutboundEmail.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+
+
+def drain_outbox(batch_size=100, max_attempts=8, connection=None):
+    # Send one batch of due emails over a single reused connection. Returns
+    # (sent, failed) counts; failures are rescheduled with exponential
+    # backoff until max_attempts, then left as 'failed'. No transaction is
+    # open while talking to the SMTP server, so other writers never wait
+    # on it.
+    connection = connection or get_connection()
+    sent = failed = 0
+
+    batch = claim_batch(batch_size)
+    if not batch:
+        return sent, failed
+
+    try:
+        connection.open()
+    except Exception as e:
+        # Server unreachable: the whole claimed batch backs off together
+        for email in batch:
+            record_failure(email, e, max_attempts)
+        save_results(batch)
+        return sent, len(batch)
+
+    try:
+        for email in batch:
+            try:
+                connection.send_messages([as_message(email, connection)])
+            except Exception as e:
+                failed += 1
+                record_failure(email, e, max_attempts)
+                # Start the next message on a fresh connection; if the
+                # server is still unreachable, send_messages tries again
+                # and the failure is recorded against that message
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception:
+                    pass
+            else:
+                sent += 1
+                email.attempts += 1
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.last_error = ''
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    save_results(batch)
+    return sent, failed
@@ -0,0 +1,73 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def page_size_from(request):
+    default = getattr(settings, 'KEYSET_PAGE_SIZE', 20)
+    maximum = getattr(settings, 'KEYSET_MAX_PAGE_SIZE', 100)
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        raise InvalidCursor('Invalid page_size')
+    return min(max(page_size, 1), maximum)
+
+
+def encode_cursor(row, keys):
+    values = [getattr(row, key) for key in keys]
+    payload = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, model, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise InvalidCursor('Invalid cursor')
+        return [model._meta.get_field(key).to_python(value) for key, value in zip(keys, values)]
+    except (binascii.Error, UnicodeError, ValueError, ValidationError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def after_cursor(keys, values, ascending=False):
+    # Rows strictly after the cursor in descending (k1, k2, ...) order:
+    # k1 < v1 OR (k1 = v1 AND k2 < v2) OR ... (with > when ascending)
+    lookup = 'gt' if ascending else 'lt'
+    condition = Q()
+    for i, key in enumerate(keys):
+        step = Q(**{f'{key}__{lookup}': values[i]})
+        for previous_key, previous_value in zip(keys[:i], values[:i]):
+            step &= Q(**{previous_key: previous_value})
+        condition |= step
+    return condition
+
+
+def paginate_keyset(request, queryset, keys=('created_at', 'id'), ascending=False):
+    # Newest-first (or oldest-first) keyset pagination: every page is a
+    # range scan on an index over `keys`, however deep the client pages.
+    page_size = page_size_from(request)
+    queryset = queryset.order_by(*(key if ascending else f'-{key}' for key in keys))
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        queryset = queryset.filter(
+            after_cursor(keys, decode_cursor(cursor, queryset.model, keys), ascending)
+        )
+
+    rows = list(queryset[:page_size + 1])
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_url = replace_query_param(
+            request.build_absolute_uri(), 'cursor', encode_cursor(rows[-1], keys)
+        )
+    return rows, next_url
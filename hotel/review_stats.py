@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+
+from .cache import bump_hotel_versions
+from .models import Hotel, Review
+
+RATINGS = range(1, 6)
+STATS_FIELDS = Hotel.STATS_FIELDS
+
+
+def _histogram_max(hotel):
+    for rating in reversed(RATINGS):
+        if getattr(hotel, f'ratings_{rating}'):
+            return rating
+    return None
+
+
+def update_review_stats(hotel_id, removed=None, added=None):
+    # Apply one review change to the hotel's stats; call inside the same
+    # transaction that saved or deleted the review.
+    hotel = Hotel.objects.select_for_update().only('id', 'location', *STATS_FIELDS).get(pk=hotel_id)
+
+    if removed is not None:
+        hotel.review_count -= 1
+        hotel.rating_sum -= removed
+        if removed in RATINGS:
+            setattr(hotel, f'ratings_{removed}', getattr(hotel, f'ratings_{removed}') - 1)
+    if added is not None:
+        hotel.review_count += 1
+        hotel.rating_sum += added
+        if added in RATINGS:
+            setattr(hotel, f'ratings_{added}', getattr(hotel, f'ratings_{added}') + 1)
+
+    hotel.rating_max = _histogram_max(hotel)
+    hotel.save(update_fields=STATS_FIELDS)
+
+
+@transaction.atomic
+def recompute_review_stats(hotel_ids=None, batch_size=500):
+    hotels = Hotel.objects.all()
+    reviews = Review.objects.all()
+    if hotel_ids:
+        hotels = hotels.filter(pk__in=hotel_ids)
+        reviews = reviews.filter(hotel_id__in=hotel_ids)
+
+    hotels.update(
+        review_count=0, rating_sum=0, rating_max=None,
+        **{f'ratings_{rating}': 0 for rating in RATINGS},
+    )
+    stats = reviews.order_by().values('hotel_id').annotate(
+        review_count=Count('id'),
+        rating_sum=Sum('rating'),
+        rating_max=Max('rating'),
+        **{f'ratings_{rating}': Count('id', filter=Q(rating=rating)) for rating in RATINGS},
+    )
+    updated = [
+        Hotel(pk=row.pop('hotel_id'), **row)
+        for row in stats
+    ]
+    Hotel.objects.bulk_update(updated, STATS_FIELDS, batch_size=batch_size)
+    bump_hotel_versions(hotels.values_list('pk', flat=True))
+    return len(updated)
@@ -1,8 +1,10 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import CustomUser, Profile, Hotel, HotelImage, Booking, Review, Transaction
+from .models import CustomUser, Profile, Hotel, HotelImage, Booking, Review, RoomHold, Transaction
+from .images import reuse_variants, store_original, variant_url
 from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
 from datetime import date
-from django.db.models import Avg, Max
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,7 +28,17 @@ class ProfileSerializer(serializers.ModelSerializer):
         fields = ['phone_number', 'wallet_balance', 'created_at', 'user',]
         read_only_fields = ['wallet_balance', 'created_at', 'user']
 
-class HotelSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    # Accepts a `fields` kwarg limiting which fields are serialized, so
+    # expensive computed fields are skipped when the client doesn't ask
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class HotelSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     max_rating = serializers.SerializerMethodField()
@@ -36,34 +48,90 @@ class HotelSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'available_rooms','image']
     
     def get_image(self, obj):
-        first_image = obj.images.first()  # related_name='images'
-        if first_image:
+        if hasattr(obj, 'first_image'):  # annotated by Hotel.objects.for_listing()
+            image_name, variants = obj.first_image, obj.first_image_variants
+        else:
+            first_image = obj.images.first()  # related_name='images'
+            image_name = first_image.image.name if first_image else None
+            variants = first_image.variants if first_image else None
+        if image_name:
+            # Listings show cards; views can ask for another size through
+            # the 'image_variant' context
+            image_url = variant_url(image_name, variants, self.context.get('image_variant', 'card'))
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(first_image.image.url)  # absolute URL
-            return f"https://hotel-booking-website-46ia.onrender.com{first_image.image.url}"
+                return request.build_absolute_uri(image_url)  # absolute URL
+            return f"https://hotel-booking-website-46ia.onrender.com{image_url}"
         return None
 
     def get_average_rating(self, obj):
-        avg_rating = obj.reviews.aggregate(Avg('rating'))['rating__avg']
+        if not obj.review_count:
+            return None
+        avg_rating = obj.rating_sum / obj.review_count
         return round(avg_rating, 1) if avg_rating else None
 
     def get_max_rating(self, obj):
-        max_rating = obj.reviews.aggregate(Max('rating'))['rating__max']
-        return max_rating if max_rating else None
+        return obj.rating_max if obj.rating_max else None
+
+
+class ImageReferenceSerializer(serializers.Serializer):
+    image = serializers.CharField(max_length=100)
+    alt_text = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+
+class HotelImportSerializer(serializers.ModelSerializer):
+    # Validates one import row; the images are names of files already in storage
+    images = ImageReferenceSerializer(many=True, required=False, default=list)
+
+    class Meta:
+        model = Hotel
+        fields = ['name', 'address', 'location', 'description', 'total_rooms', 'capacity_per_room', 'price_per_night', 'images']
+
 
+class ImageVariantsMixin:
+    def get_variants(self, obj):
+        # {variant: {format: url}}, empty until the image has been processed
+        request = self.context.get('request')
+        return {
+            variant: {
+                fmt: request.build_absolute_uri(default_storage.url(name)) if request else default_storage.url(name)
+                for fmt, name in formats.items()
+            }
+            for variant, formats in obj.variants.items()
+        }
 
-class HotelImageSerializer(serializers.ModelSerializer):
+
+class HotelImageSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     hotel = HotelSerializer(read_only=True)
     hotel_id = serializers.PrimaryKeyRelatedField(
         queryset=Hotel.objects.all(), write_only=True, source='hotel'
     )
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = HotelImage
-        fields = ['id', 'hotel', 'hotel_id', 'image', 'alt_text']
+        fields = ['id', 'hotel', 'hotel_id', 'image', 'alt_text', 'variants']
         read_only_fields = ['id', 'hotel']
 
+    def create(self, validated_data):
+        # The original is stored under its content hash; resized copies are
+        # made later by `manage.py process_images`
+        name, content_hash = store_original(validated_data.pop('image'))
+        image = HotelImage.objects.create(image=name, content_hash=content_hash, **validated_data)
+        reuse_variants(image)
+        return image
+
+
+class HotelImageLeanSerializer(ImageVariantsMixin, serializers.ModelSerializer):
+    # Listing shape without the embedded hotel; reads only HotelImage columns
+    hotel_id = serializers.IntegerField(read_only=True)
+    variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = HotelImage
+        fields = ['id', 'hotel_id', 'image', 'alt_text', 'variants']
+        read_only_fields = fields
+
 class BookingSerializer(serializers.ModelSerializer):
     # hotel = HotelSerializer(read_only=True)
     hotel_name = serializers.CharField(source="hotel.name", read_only=True) 
@@ -92,9 +160,51 @@ class BookingSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("At least one room must be booked.")
         return attrs
 
-        
+
+class RoomHoldSerializer(BookingSerializer):
+    class Meta:
+        model = RoomHold
+        fields = ['token', 'hotel', 'hotel_name', 'check_in', 'check_out', 'adults', 'children', 'rooms', 'expires_at']
+        read_only_fields = ['token', 'expires_at']
+
+
+class BulkStaySerializer(BookingSerializer):
+    # Hotels are resolved for the whole basket at once in BulkBookingSerializer
+    hotel = serializers.IntegerField(min_value=1)
+
+    class Meta(BookingSerializer.Meta):
+        fields = ['hotel', 'check_in', 'check_out', 'adults', 'children', 'rooms']
+
+
+class BulkBookingSerializer(serializers.Serializer):
+    stays = BulkStaySerializer(many=True, allow_empty=False)
+    all_or_nothing = serializers.BooleanField(default=True)
+
+    def validate_stays(self, stays):
+        max_stays = getattr(settings, 'BULK_BOOKING_MAX_STAYS', 50)
+        if len(stays) > max_stays:
+            raise serializers.ValidationError(f"At most {max_stays} stays can be booked at once.")
+
+        hotels = Hotel.objects.in_bulk({stay['hotel'] for stay in stays})
+        missing = sorted({stay['hotel'] for stay in stays} - set(hotels))
+        if missing:
+            raise serializers.ValidationError(f"Unknown hotel ids: {', '.join(map(str, missing))}.")
+
+        return [
+            {
+                **stay,
+                'hotel': hotels[stay['hotel']],
+                'adults': stay.get('adults', 1),
+                'children': stay.get('children', 0),
+                'rooms': stay.get('rooms', 1),
+            }
+            for stay in stays
+        ]
+
 
 class ReviewSerializer(serializers.ModelSerializer):
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+
     class Meta:
         model = Review
         fields = '__all__'
@@ -113,6 +223,7 @@ class HotelSearchSerializer(serializers.Serializer):
     adults = serializers.IntegerField(min_value=1)
     children = serializers.IntegerField(min_value=0)
     rooms = serializers.IntegerField(min_value=1)
+    flex_days = serializers.IntegerField(min_value=0, max_value=14, default=0)
 
     def validate(self, attrs):
         check_in = attrs.get('check_in')
@@ -136,3 +247,20 @@ class HotelSearchSerializer(serializers.Serializer):
 
 
     
+
+
+class HotelCalendarSerializer(serializers.Serializer):
+    month = serializers.DateField(input_formats=['%Y-%m'])
+    months = serializers.IntegerField(min_value=1, max_value=12, default=1)
+
+
+class ExportFilterSerializer(serializers.Serializer):
+    start = serializers.DateField(input_formats=['%Y-%m-%d'], required=False)
+    end = serializers.DateField(input_formats=['%Y-%m-%d'], required=False)
+    # Staff can export every user's rows instead of their own
+    scope = serializers.ChoiceField(choices=['mine', 'all'], default='mine')
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['end'] < attrs['start']:
+            raise serializers.ValidationError("End date must not be before start date.")
+        return attrs
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .auth import invalidate_user
+from .cache import bump_hotel_versions
+from .models import Booking, CustomUser, Hotel, HotelImage, Profile, Review
+from .occupancy import occupancy_index
+
+OCCUPANCY_FIELDS = ('hotel_id', 'check_in', 'check_out', 'rooms', 'status')
+
+
+def occupancy_state(booking):
+    # Read straight from __dict__ so deferred fields never trigger a query
+    values = tuple(booking.__dict__.get(field) for field in OCCUPANCY_FIELDS)
+    if booking.pk is None or None in values:
+        return None
+    return values
+
+
+def apply_occupancy(state, sign):
+    hotel_id, check_in, check_out, rooms, status = state
+    if status == 'booked':
+        transaction.on_commit(
+            lambda: occupancy_index.apply(hotel_id, check_in, check_out, sign * rooms)
+        )
+
+
+@receiver(post_init, sender=Booking)
+def remember_booking_occupancy(sender, instance, **kwargs):
+    instance._occupancy_state = occupancy_state(instance)
+
+
+@receiver(post_save, sender=Booking)
+def update_occupancy_on_save(sender, instance, created, **kwargs):
+    previous = None if created else instance._occupancy_state
+    current = occupancy_state(instance)
+
+    if previous != current:
+        if previous is None and not created:
+            hotel_id = instance.hotel_id
+            transaction.on_commit(lambda: occupancy_index.invalidate(hotel_id))
+        else:
+            if previous is not None:
+                apply_occupancy(previous, -1)
+            if current is not None:
+                apply_occupancy(current, 1)
+    instance._occupancy_state = current
+
+
+@receiver(post_delete, sender=Booking)
+def update_occupancy_on_delete(sender, instance, **kwargs):
+    if instance._occupancy_state is not None:
+        apply_occupancy(instance._occupancy_state, -1)
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_delete, sender=Hotel)
+def bump_hotel_cache(sender, instance, **kwargs):
+    bump_hotel_versions([instance.pk])
+
+
+@receiver(post_save, sender=HotelImage)
+@receiver(post_delete, sender=HotelImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_hotel_cache_for_related(sender, instance, **kwargs):
+    bump_hotel_versions([instance.hotel_id])
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
@@ -1,3 +1,1298 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import serializers, wallet
+from .auth import user_cache
+from .booking import BookingError, book_stay
+from .models import (
+    Booking, CustomUser, Hotel, HotelImage, ImportCheckpoint, OutboundEmail, Profile, Review, RoomHold, RoomInventory, Transaction,
+    WalletCheckpoint,
+)
+from .occupancy import (
+    OccupancyIndex, OccupancyTree, flexible_availability, occupancy_index, overlapping_stays, window_peaks,
+)
+from .outbox import drain_outbox, enqueue_email
+from .images import process_batch, process_pending
+from .inventory import NotEnoughRooms, booked_rooms, count_rooms_sold, rebuild_inventory, release_rooms, reserve_rooms
+from .pagination import after_cursor
+from .review_stats import STATS_FIELDS, recompute_review_stats, update_review_stats
+from .throttling import TokenBucketThrottle, admission
+from .utils import normalize_location
+
+
+def create_hotel(name='Hotel', location='Dhaka', total_rooms=5, **kwargs):
+    return Hotel.objects.create(
+        name=name,
+        address='1 Main Road',
+        location=location,
+        description='A hotel',
+        total_rooms=total_rooms,
+        price_per_night=100,
+        **kwargs,
+    )
+
+
+class QueryCountMixin:
+    # Asserts an endpoint runs the same fixed number of queries however many
+    # rows it returns: call it once, grow the data, then call it again.
+    def assertFixedQueries(self, expected, url, grow, data=None):
+        with self.assertNumQueries(expected):
+            first = self.client.get(url, data)
+        self.assertEqual(first.status_code, 200)
+
+        grow()
+        occupancy_index.clear()
+        cache.clear()
+        with self.assertNumQueries(expected):
+            second = self.client.get(url, data)
+        self.assertEqual(second.status_code, 200)
+        return first, second
+
+
+class HotelEndpointQueryCountTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        occupancy_index.clear()
+        cache.clear()
+        self.user = CustomUser.objects.create(email='guest@example.com')
+        self.hotel = self.add_hotel()
+
+    def add_hotel(self):
+        hotel = create_hotel()
+        HotelImage.objects.create(hotel=hotel, image='hotel_images/front.webp')
+        HotelImage.objects.create(hotel=hotel, image='hotel_images/lobby.webp')
+        Review.objects.create(user=self.user, hotel=hotel, rating=4)
+        return hotel
+
+    def add_hotels(self, count=5):
+        for _ in range(count):
+            self.add_hotel()
+        recompute_review_stats()
+
+    def test_hotel_list(self):
+        recompute_review_stats()
+        first, second = self.assertFixedQueries(1, '/hotels/', self.add_hotels)
+        self.assertEqual(len(second.json()['results']), 6)
+        self.assertTrue(second.json()['results'][0]['image'].endswith('/media/hotel_images/front.webp'))
+        self.assertEqual(second.json()['results'][0]['average_rating'], 4.0)
+
+    def test_hotel_list_with_fields(self):
+        first, second = self.assertFixedQueries(1, '/hotels/', self.add_hotels, {'fields': 'id,name'})
+        self.assertEqual(set(second.json()['results'][0]), {'id', 'name'})
+        # The first-image subquery is only added when the image is asked for
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/hotels/', {'fields': 'id,name', 'page_size': 2})
+        self.assertNotIn('hotel_hotelimage', queries[0]['sql'])
+        with CaptureQueriesContext(connection) as queries:
+            listing = self.client.get('/hotels/', {'fields': 'id,image'}).json()
+        self.assertIn('hotel_hotelimage', queries[0]['sql'])
+        self.assertTrue(listing['results'][0]['image'].endswith('/media/hotel_images/front.webp'))
+
+    def test_hotel_detail(self):
+        self.assertFixedQueries(1, f'/hotel-details/{self.hotel.id}/', self.add_hotels)
+
+    def test_hotel_images(self):
+        first, second = self.assertFixedQueries(2, '/hotel-images/', self.add_hotels)
+        self.assertEqual(len(second.json()['results']), 12)
+
+    def test_lean_hotel_images_for_one_hotel(self):
+        query = {'hotel_id': self.hotel.id, 'mode': 'lean', 'page_size': 1}
+        first, second = self.assertFixedQueries(1, '/hotel-images/', self.add_hotels, query)
+        page = second.json()
+        self.assertEqual(set(page['results'][0]), {'id', 'hotel_id', 'image', 'alt_text', 'variants'})
+        self.assertEqual(page['results'][0]['hotel_id'], self.hotel.id)
+        self.assertTrue(page['results'][0]['image'].endswith('front.webp'))
+
+        with self.assertNumQueries(1):
+            last = self.client.get(page['next']).json()
+        self.assertTrue(last['results'][0]['image'].endswith('lobby.webp'))
+        self.assertIsNone(last['next'])
+
+    def test_search(self):
+        check_in = date.today() + timedelta(days=7)
+        query = {
+            'location': 'dhaka',
+            'check_in': check_in,
+            'check_out': check_in + timedelta(days=2),
+            'adults': 2,
+            'children': 0,
+            'rooms': 1,
+        }
+
+        def grow():
+            self.add_hotels()
+            Booking.objects.create(
+                user=self.user, hotel=self.hotel, check_in=check_in,
+                check_out=check_in + timedelta(days=1), total_price=100,
+            )
+
+        # One query for the candidate hotels, one to load their occupancy
+        first, second = self.assertFixedQueries(2, '/search/', grow, query)
+        self.assertEqual(len(second.json()['results']), 6)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email='guest@example.com')
+        self.hotel = create_hotel()
+
+    def test_matching_etag_returns_not_modified(self):
+        for url in ['/hotels/', f'/hotel-details/{self.hotel.id}/', f'/hotels/{self.hotel.id}/reviews/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['ETag'].startswith('"'))
+            self.assertIn('Last-Modified', response)
+
+            with self.assertNumQueries(0):
+                cached = self.client.get(url)
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_review_change_invalidates_hotel_and_catalogue(self):
+        detail = self.client.get(f'/hotel-details/{self.hotel.id}/')
+        catalogue = self.client.get('/hotels/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.user, hotel=self.hotel, rating=5)
+
+        self.assertEqual(
+            self.client.get(f'/hotel-details/{self.hotel.id}/', HTTP_IF_NONE_MATCH=detail['ETag']).status_code,
+            200,
+        )
+        self.assertEqual(self.client.get('/hotels/', HTTP_IF_NONE_MATCH=catalogue['ETag']).status_code, 200)
+        reviews = self.client.get(f'/hotels/{self.hotel.id}/reviews/').json()
+        self.assertEqual(len(reviews), 1)
+
+
+class BookingConcurrencyTests(TransactionTestCase):
+    threads = 8
+    attempts_per_thread = 6
+
+    def setUp(self):
+        occupancy_index.clear()
+        self.check_in = date.today() + timedelta(days=10)
+        self.hotels = [create_hotel(name='Busy', total_rooms=10), create_hotel(name='Quiet', total_rooms=10)]
+        self.users = []
+        for i in range(self.threads):
+            user = CustomUser.objects.create(email=f'guest{i}@example.com')
+            Profile.objects.create(user=user, wallet_balance=100000, phone_number='')
+            self.users.append(user)
+
+    def book_concurrently(self):
+        barrier = threading.Barrier(self.threads)
+        outcomes = []
+
+        def worker(user, hotel):
+            barrier.wait()
+            try:
+                for _ in range(self.attempts_per_thread):
+                    try:
+                        book_stay(user, hotel, self.check_in, self.check_in + timedelta(days=2))
+                        outcomes.append('booked')
+                    except BookingError:
+                        outcomes.append('rejected')
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=worker, args=(user, self.hotels[i % 2]))
+            for i, user in enumerate(self.users)
+        ]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return outcomes, time.perf_counter() - started
+
+    def test_no_overbooking_under_concurrent_load(self):
+        outcomes, elapsed = self.book_concurrently()
+        booked = outcomes.count('booked')
+        print(f'\n{booked} bookings in {elapsed:.2f}s ({booked / elapsed:.1f} bookings/sec, '
+              f'{outcomes.count("rejected")} rejected)')
+
+        for hotel in self.hotels:
+            rooms = Booking.objects.filter(hotel=hotel, status='booked').aggregate(total=Sum('rooms'))['total']
+            self.assertEqual(rooms, hotel.total_rooms)
+            nights = RoomInventory.objects.filter(hotel=hotel).values_list('rooms_sold', flat=True)
+            self.assertEqual(list(nights), [hotel.total_rooms, hotel.total_rooms])
+
+        paid = Transaction.objects.filter(transaction_type='Booking Payment').aggregate(total=Sum('amount'))['total']
+        wallets = Profile.objects.aggregate(total=Sum('wallet_balance'))['total']
+        self.assertEqual(paid + wallets, 100000 * self.threads)
+
+
+class BulkBookingTests(TestCase):
+    def setUp(self):
+        occupancy_index.clear()
+        self.user = CustomUser.objects.create(email='corporate@example.com')
+        Profile.objects.create(user=self.user, wallet_balance=1000, phone_number='')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.check_in = date.today() + timedelta(days=5)
+        self.hotels = [create_hotel(name='North', total_rooms=2), create_hotel(name='South', total_rooms=1)]
+
+    def stay(self, hotel, rooms=1, nights=2):
+        return {
+            'hotel': hotel.id,
+            'check_in': self.check_in,
+            'check_out': self.check_in + timedelta(days=nights),
+            'rooms': rooms,
+        }
+
+    def book(self, stays, all_or_nothing):
+        return self.client.post(
+            '/bookings/bulk/', {'stays': stays, 'all_or_nothing': all_or_nothing}, format='json'
+        )
+
+    def test_all_or_nothing_books_nothing_when_a_stay_is_rejected(self):
+        # South's only room is taken by the first stay in the basket
+        stays = [self.stay(self.hotels[1]), self.stay(self.hotels[0]), self.stay(self.hotels[1])]
+        response = self.book(stays, True)
+
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['rejected'] * 3)
+        # Only the stay that failed reports why; the others say they were
+        # held back by it
+        self.assertEqual([r['detail'] for r in results], [
+            'Not booked: another stay in the basket was rejected.',
+            'Not booked: another stay in the basket was rejected.',
+            'Not enough rooms available for the selected dates.',
+        ])
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(Profile.objects.get().wallet_balance, 1000)
+
+    def test_hotel_without_room_capacity_takes_no_guests(self):
+        # Search leaves these hotels out; a direct booking is refused too
+        unsized = create_hotel(name='Unsized', capacity_per_room=None)
+        response = self.book([self.stay(self.hotels[0]), self.stay(unsized)], False)
+
+        self.assertEqual(response.status_code, 201)
+        rejected = response.json()['results'][1]
+        self.assertEqual(rejected['status'], 'rejected')
+        self.assertEqual(rejected['detail'], 'Selected rooms cannot accommodate the number of guests.')
+
+    def test_best_effort_books_what_fits_with_one_debit(self):
+        stays = [self.stay(self.hotels[1]), self.stay(self.hotels[0], rooms=2), self.stay(self.hotels[1])]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.book(stays, False)
+
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body['booked'], body['rejected']), (2, 1))
+        self.assertEqual(body['results'][2]['detail'], 'Not enough rooms available for the selected dates.')
+
+        self.assertEqual(Booking.objects.count(), 2)
+        self.assertEqual(Transaction.objects.filter(transaction_type='Booking Payment').count(), 2)
+        self.assertEqual(Profile.objects.get().wallet_balance, 1000 - 200 - 400)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+        for hotel in self.hotels:
+            self.assertEqual(occupancy_index.peak(hotel.id, self.check_in, self.check_in + timedelta(days=2)),
+                             hotel.total_rooms)
+            self.assertTrue(occupancy_index.verify(hotel.id))
+
+    def test_stays_beyond_the_balance_are_rejected(self):
+        stays = [self.stay(self.hotels[0], nights=6), self.stay(self.hotels[1], nights=6)]
+        body = self.book(stays, False).json()
+        self.assertEqual(body['results'][1]['detail'], 'Insufficient wallet balance.')
+        self.assertEqual(Profile.objects.get().wallet_balance, 400)
+
+
+class RoomHoldTests(TestCase):
+    def setUp(self):
+        occupancy_index.clear()
+        self.hotel = create_hotel(total_rooms=1)
+        self.check_in = date.today() + timedelta(days=3)
+        self.clients = []
+        for email in ['holder@example.com', 'rival@example.com']:
+            user = CustomUser.objects.create(email=email)
+            Profile.objects.create(user=user, wallet_balance=1000, phone_number='')
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+
+    def stay(self, **extra):
+        return {
+            'hotel': self.hotel.id,
+            'check_in': self.check_in,
+            'check_out': self.check_in + timedelta(days=2),
+            **extra,
+        }
+
+    def free_rooms(self):
+        query = {**self.stay(), 'location': 'dhaka', 'adults': 1, 'children': 0, 'rooms': 1}
+        del query['hotel']
+        return [hotel['available_rooms'] for hotel in self.clients[1].get('/search/', query).json()['results']]
+
+    def test_hold_blocks_other_guests_until_converted(self):
+        holder, rival = self.clients
+        with self.captureOnCommitCallbacks(execute=True):
+            hold = holder.post('/holds/', self.stay(), format='json')
+        self.assertEqual(hold.status_code, 201)
+        self.assertEqual(self.free_rooms(), [])
+        self.assertEqual(rival.post('/bookings/', self.stay(), format='json').status_code, 400)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booked = holder.post('/bookings/', {'hold_token': hold.json()['token']}, format='json')
+        self.assertEqual(booked.status_code, 201)
+        self.assertFalse(RoomHold.objects.exists())
+        self.assertEqual(Booking.objects.get().total_price, 200)
+        self.assertTrue(occupancy_index.verify(self.hotel.id))
+
+        # A hold converts once
+        again = holder.post('/bookings/', {'hold_token': hold.json()['token']}, format='json')
+        self.assertEqual(again.status_code, 400)
+
+    def test_expired_holds_stop_counting_and_are_swept_in_one_statement(self):
+        holder, rival = self.clients
+        token = holder.post('/holds/', self.stay(), format='json').json()['token']
+        self.assertEqual(self.free_rooms(), [])
+
+        later = timezone.now() + timedelta(hours=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(self.free_rooms(), [1])
+            self.assertEqual(holder.post('/bookings/', {'hold_token': token}, format='json').status_code, 400)
+
+            with self.assertNumQueries(1):
+                call_command('sweep_holds', stdout=mock.MagicMock())
+            self.assertFalse(RoomHold.objects.exists())
+            self.assertEqual(rival.post('/bookings/', self.stay(), format='json').status_code, 201)
+
+
+class ImportHotelsTests(TestCase):
+    def write(self, suffix, content):
+        f = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+        with f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def import_file(self, path, *args):
+        call_command('import_hotels', path, *args, stdout=mock.MagicMock(), stderr=mock.MagicMock())
+
+    def test_csv_rows_are_imported_with_images(self):
+        path = self.write('.csv', (
+            'name,address,location,description,total_rooms,price_per_night,images\n'
+            'Sea View,1 Beach Rd,Cox\'s Bazar,By the sea,10,80.00,hotel_images/a.webp|hotel_images/b.webp\n'
+            'Broken,2 Beach Rd,Cox\'s Bazar,No price,5,,\n'
+        ))
+        self.import_file(path)
+
+        hotel = Hotel.objects.get()
+        self.assertEqual(hotel.location_key, normalize_location("Cox's Bazar"))
+        self.assertEqual(list(hotel.images.values_list('image', flat=True)), ['hotel_images/a.webp', 'hotel_images/b.webp'])
+        self.assertEqual(ImportCheckpoint.objects.get().rows_done, 2)
+
+    def test_resumes_from_checkpoint_after_a_failure(self):
+        rows = [
+            {'name': f'Hotel {i}', 'address': 'Road', 'location': 'Dhaka', 'description': 'A hotel',
+             'price_per_night': '100.00', 'images': [{'image': f'hotel_images/{i}.webp', 'alt_text': 'Front'}]}
+            for i in range(7)
+        ]
+        path = self.write('.jsonl', '\n'.join(json.dumps(row) for row in rows) + '\n')
+
+        create = HotelImage.objects.bulk_create
+        calls = []
+
+        def fail_on_second_batch(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('connection lost')
+            return create(*args, **kwargs)
+
+        with mock.patch.object(HotelImage.objects, 'bulk_create', side_effect=fail_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.import_file(path, '--batch-size', '3')
+        self.assertEqual(Hotel.objects.count(), 3)
+
+        self.import_file(path, '--batch-size', '3')
+        self.assertEqual(
+            list(Hotel.objects.order_by('id').values_list('name', flat=True)), [row['name'] for row in rows]
+        )
+        self.assertEqual(HotelImage.objects.count(), 7)
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email='corporate@example.com')
+        hotel = create_hotel()
+        check_in = date.today() + timedelta(days=1)
+        for _ in range(5):
+            booking = Booking.objects.create(
+                user=self.user, hotel=hotel, check_in=check_in, check_out=check_in + timedelta(days=1), total_price=100,
+            )
+            Transaction.objects.create(user=self.user, booking=booking, amount=100, transaction_type='Booking Payment')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_history_pages_newest_first(self):
+        for url, model in [('/bookings/', Booking), ('/transactions/', Transaction)]:
+            seen = []
+            page = self.client.get(url, {'page_size': 2}).json()
+            while True:
+                seen += [row['id'] for row in page['results']]
+                if not page['next']:
+                    break
+                with self.assertNumQueries(1):
+                    page = self.client.get(page['next']).json()
+            self.assertEqual(seen, list(model.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_pages_are_index_range_scans(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan format is SQLite specific')
+        for model, index in [(Booking, 'booking_user_created_idx'), (Transaction, 'transaction_user_created_idx')]:
+            newest = model.objects.order_by('-created_at', '-id').first()
+            page = model.objects.filter(user=self.user).filter(
+                after_cursor(('created_at', 'id'), [newest.created_at, newest.id])
+            ).order_by('-created_at', '-id')[:20]
+            plan = page.explain()
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class OverlapQueryPlanTests(TestCase):
+    def test_overlap_lookup_uses_the_live_booking_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan format is SQLite specific')
+        start = date.today()
+        plan = overlapping_stays([1, 2], start, start + timedelta(days=3)).explain()
+        self.assertIn('COVERING INDEX booking_live_overlap_idx', plan)
+        self.assertNotIn('SCAN hotel_booking', plan)
+        self.assertNotIn('SCAN hotel_roomhold', plan)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.hotel = create_hotel()
+        self.user = CustomUser.objects.create(email='guest@example.com')
+        other = CustomUser.objects.create(email='other@example.com')
+        check_in = date.today() + timedelta(days=1)
+        for user in [self.user, self.user, other]:
+            booking = Booking.objects.create(
+                user=user, hotel=self.hotel, check_in=check_in, check_out=check_in + timedelta(days=1), total_price=100,
+            )
+            Transaction.objects.create(user=user, booking=booking, amount=100, transaction_type='Booking Payment')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_users_stream_their_own_rows(self):
+        rows = list(csv.DictReader(io.StringIO(self.read(self.client.get('/bookings/export.csv')))))
+        self.assertEqual([row['user_email'] for row in rows], ['guest@example.com'] * 2)
+        self.assertEqual(rows[0]['hotel_name'], 'Hotel')
+
+        lines = self.read(self.client.get('/transactions/export.jsonl')).splitlines()
+        self.assertEqual([json.loads(line)['amount'] for line in lines], ['100.00', '100.00'])
+
+        tomorrow = date.today() + timedelta(days=1)
+        self.assertEqual(self.read(self.client.get('/bookings/export.jsonl', {'start': tomorrow})), '')
+
+    def test_full_table_export_is_staff_only(self):
+        self.assertEqual(self.client.get('/bookings/export.csv', {'scope': 'all'}).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        rows = self.read(self.client.get('/bookings/export.csv', {'scope': 'all'})).splitlines()
+        self.assertEqual(len(rows), 4)
+
+        out = io.StringIO()
+        call_command('export_records', 'transactions', '--format', 'jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        cache.clear()
+        self.hotel = create_hotel()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(email='owner@example.com'))
+
+    def upload(self, name, content):
+        return self.client.post('/hotel-images/', {
+            'hotel_id': self.hotel.id, 'image': SimpleUploadedFile(name, content),
+        }, format='multipart')
+
+    def photo(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'teal').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_duplicate_uploads_share_storage_and_variants(self):
+        first = self.upload('lobby.png', self.photo())
+        second = self.upload('copy.png', self.photo())
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json()['image'], second.json()['image'])
+        self.assertEqual(first.json()['variants'], {})
+
+        self.assertEqual(self.upload('broken.png', b'not an image').status_code, 400)
+        # An existing file that Pillow can't read is skipped, not retried
+        HotelImage.objects.create(
+            hotel=self.hotel, image=default_storage.save('hotel_images/broken.png', ContentFile(b'not an image')),
+        )
+        call_command('process_images', '--workers', '2', stdout=mock.MagicMock())
+
+        processed = HotelImage.objects.order_by('id')
+        self.assertEqual(processed[0].variants, processed[1].variants)
+        self.assertEqual(processed[2].variants, {})
+        with default_storage.open(processed[0].variants['card']['webp']) as f:
+            self.assertEqual(Image.open(f).size, (480, 240))
+
+        # Listings now point at the card variant instead of the original
+        listing = self.client.get('/hotels/').json()['results'][0]
+        self.assertTrue(listing['image'].endswith(f"{processed[0].content_hash}-card.webp"))
+
+        # Content that was already processed gets its variants on upload
+        third = self.upload('again.png', self.photo())
+        self.assertEqual(set(third.json()['variants']), {'thumb', 'card', 'full'})
+
+    def image(self, name, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'teal').save(buffer, 'PNG')
+        return HotelImage.objects.create(
+            hotel=self.hotel, image=default_storage.save(f'hotel_images/{name}', ContentFile(buffer.getvalue())),
+        )
+
+    def test_bad_images_do_not_stall_the_queue(self):
+        bomb = self.image('bomb.png', (200, 100))
+        small = self.image('small.png', (40, 20))
+        # Anything over twice MAX_IMAGE_PIXELS is refused as a decompression bomb
+        with mock.patch('PIL.Image.MAX_IMAGE_PIXELS', 1000):
+            self.assertEqual(process_pending(workers=0), (1, 1))
+        bomb.refresh_from_db()
+        small.refresh_from_db()
+        self.assertEqual((bomb.variants, small.variants['thumb']['webp'].endswith('-thumb.webp')), ({}, True))
+        self.assertIsNotNone(bomb.processed_at)
+
+        # A worker process dying on an image fails that image only
+        crashed = self.image('crash.png', (30, 30))
+        pool = mock.MagicMock()
+        pool.submit.return_value.result.side_effect = BrokenProcessPool()
+        self.assertEqual(process_batch([crashed], pool), (0, 1))
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.variants, {})
+        self.assertIsNotNone(crashed.processed_at)
+
+
+class MediaServingTests(TestCase):
+    hashed = 'hotel_images/ab/' + 'ab' * 32 + '-card.webp'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        for name in [self.hashed, 'hotel_images/lobby.jpeg']:
+            os.makedirs(os.path.dirname(os.path.join(media.name, name)), exist_ok=True)
+            with open(os.path.join(media.name, name), 'wb') as f:
+                f.write(b'0123456789')
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_hashed_files_are_immutable_and_revalidate(self):
+        response = self.client.get(f'/media/{self.hashed}')
+        self.assertEqual(self.body(response), b'0123456789')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+        not_modified = self.client.get(f'/media/{self.hashed}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        plain = self.client.get('/media/hotel_images/lobby.jpeg')
+        self.assertEqual(plain['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+
+    def test_byte_ranges(self):
+        url = f'/media/{self.hashed}'
+        for header, status, body, content_range in [
+            ('bytes=2-5', 206, b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', 206, b'789', 'bytes 7-9/10'),
+            ('bytes=-3', 206, b'789', 'bytes 7-9/10'),
+            ('bytes=0-1,4-5', 200, b'0123456789', None),
+        ]:
+            response = self.client.get(url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(self.body(response), body)
+            self.assertEqual(response.get('Content-Range'), content_range)
+
+        unsatisfiable = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual((unsatisfiable.status_code, unsatisfiable['Content-Range']), (416, 'bytes */10'))
+
+        # A stale If-Range gets the whole (changed) file
+        stale = self.client.get(url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"other"')
+        self.assertEqual(stale.status_code, 200)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_accel_redirect_leaves_the_body_to_nginx(self):
+        response = self.client.get('/media/hotel_images/lobby.jpeg')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/hotel_images/lobby.jpeg')
+        self.assertEqual(response.content, b'')
+
+
+class OutboxTests(TestCase):
+    def register(self):
+        return self.client.post('/register/', {
+            'first_name': 'Ada', 'last_name': 'Guest', 'email': 'ada@example.com', 'password': 'a-long-passphrase',
+        })
+
+    def test_registration_queues_email_for_the_worker(self):
+        self.assertEqual(self.register().status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().status, 'pending')
+
+        call_command('send_outbox', stdout=mock.MagicMock())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ada@example.com'])
+        self.assertEqual(mail.outbox[0].content_subtype, 'html')
+        self.assertEqual(OutboundEmail.objects.get().status, 'sent')
+
+    def test_failed_sends_are_retried_with_backoff(self):
+        self.register()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(drain_outbox(), (0, 1))
+
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('pending', 1, 'down'))
+        # Not due yet, so nothing is sent until the backoff has passed
+        self.assertEqual(drain_outbox(), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt_at=email.created_at)
+        self.assertEqual(drain_outbox(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_connection_is_reopened_after_a_failed_send(self):
+        for to in ('a@example.com', 'b@example.com'):
+            enqueue_email(to, 'Hello', 'Body')
+        smtp = mock.MagicMock()
+        smtp.send_messages.side_effect = [OSError('reset'), 1]
+
+        self.assertEqual(drain_outbox(connection=smtp), (1, 1))
+        self.assertEqual(smtp.open.call_count, 2)
+        self.assertEqual(smtp.send_messages.call_count, 2)
+
+    def test_unreachable_server_reschedules_the_batch(self):
+        for to in ('a@example.com', 'b@example.com'):
+            enqueue_email(to, 'Hello', 'Body')
+        # A port nothing listens on, so connecting is refused
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST='127.0.0.1', EMAIL_PORT=port, EMAIL_USE_TLS=False, EMAIL_TIMEOUT=5):
+            self.assertEqual(drain_outbox(), (0, 2))
+
+        for email in OutboundEmail.objects.all():
+            self.assertEqual((email.status, email.attempts), ('pending', 1))
+            self.assertNotEqual(email.last_error, '')
+            self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(drain_outbox(), (0, 0))
+
+
+class OutboxWriterTests(TransactionTestCase):
+    def test_other_writers_commit_while_emails_are_sent(self):
+        enqueue_email('guest@example.com', 'Hello', 'Body')
+        writes = []
+
+        def write_elsewhere():
+            try:
+                create_hotel(name='Written during send')
+                writes.append('committed')
+            except Exception as e:
+                writes.append(e)
+            finally:
+                connection.close()
+
+        def send_messages(messages):
+            # A writer on another connection isn't blocked by the drain
+            self.assertFalse(connection.in_atomic_block)
+            writer = threading.Thread(target=write_elsewhere)
+            writer.start()
+            writer.join()
+            return len(messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=send_messages):
+            self.assertEqual(drain_outbox(), (1, 0))
+        self.assertEqual(writes, ['committed'])
+        self.assertTrue(Hotel.objects.filter(name='Written during send').exists())
+        self.assertEqual(OutboundEmail.objects.get().status, 'sent')
+
+
+
+@override_settings(AUTH_USER_CACHE=True)
+class AuthUserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.user = CustomUser.objects.create(email='guest@example.com')
+        Profile.objects.create(user=self.user, phone_number='0123', wallet_balance=100)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def balance(self):
+        return self.client.get('/profiles/').json()['wallet_balance']
+
+    def test_warm_requests_authenticate_without_queries(self):
+        # The user with their profile, then the balance
+        with self.assertNumQueries(2):
+            self.assertEqual(self.balance(), '100.00')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.balance(), '100.00')
+        self.assertEqual(user_cache.stats(), {'enabled': True, 'hits': 1, 'misses': 1, 'size': 1})
+
+    @override_settings(AUTH_USER_CACHE='auto')
+    def test_not_used_without_a_shared_cache(self):
+        self.balance()
+        with self.assertNumQueries(3):
+            self.assertEqual(self.balance(), '100.00')
+        self.assertEqual(user_cache.stats(), {'enabled': False, 'hits': 0, 'misses': 0, 'size': 0})
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertTrue(user_cache.enabled)
+
+    def test_wallet_updates_and_saves_invalidate_the_snapshot(self):
+        self.balance()
+        with self.captureOnCommitCallbacks(execute=True):
+            wallet.deposit(self.user.id, 600)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.balance(), '700.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/profiles/').status_code, 401)
+
+    def test_requests_get_their_own_copy(self):
+        self.balance()
+        first = user_cache.get(self.user.id)
+        first.first_name = 'Changed'
+        first.profile.wallet_balance = 0
+        second = user_cache.get(self.user.id)
+        self.assertEqual((second.first_name, second.profile.wallet_balance), ('', 100))
+
+
+@override_settings(REST_FRAMEWORK={
+    'DEFAULT_AUTHENTICATION_CLASSES': ('hotel.auth.CachedJWTAuthentication',),
+    'DEFAULT_THROTTLE_RATES': {'search': '2/min', 'booking': '20/min'},
+})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        create_hotel()
+        self.search = {'location': 'Dhaka', 'check_in': date.today() + timedelta(days=1),
+                       'check_out': date.today() + timedelta(days=2), 'adults': 1, 'children': 0, 'rooms': 1}
+
+    def test_search_bucket_refills_over_time(self):
+        now = time.time()
+        with mock.patch.object(TokenBucketThrottle, 'timer', return_value=now) as timer:
+            self.assertEqual(self.client.get('/search/', self.search).status_code, 200)
+            self.assertEqual(self.client.get('/search/', self.search).status_code, 200)
+            limited = self.client.get('/search/', self.search)
+            self.assertEqual(limited.status_code, 429)
+            self.assertEqual(limited['Retry-After'], '30')
+
+            # Another client has its own bucket
+            other = self.client.get('/search/', self.search, REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(other.status_code, 200)
+
+            timer.return_value = now + 30
+            self.assertEqual(self.client.get('/search/', self.search).status_code, 200)
+
+    @override_settings(ADMISSION_LIMITS={'search': 6, 'booking': 12})
+    def test_search_is_shed_before_bookings(self):
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(email='guest@example.com'))
+        with mock.patch.object(admission, 'in_flight', 6):
+            shed = self.client.get('/search/', self.search)
+            self.assertEqual(shed.status_code, 503)
+            self.assertEqual(shed['Retry-After'], '1')
+            self.assertEqual(client.post('/bookings/', {}, format='json').status_code, 400)
+
+        with mock.patch.object(admission, 'in_flight', 12):
+            self.assertEqual(client.post('/bookings/', {}, format='json').status_code, 503)
+        self.assertEqual(admission.in_flight, 0)
+
+
+class WalletTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email='guest@example.com')
+        Profile.objects.create(user=self.user, wallet_balance=0, phone_number='')
+        self.hotel = create_hotel()
+
+    def booking(self, total_price):
+        check_in = date.today() + timedelta(days=5)
+        return Booking.objects.create(
+            user=self.user, hotel=self.hotel, check_in=check_in, check_out=check_in + timedelta(days=1),
+            total_price=total_price,
+        )
+
+    def test_payment_beyond_the_balance_is_refused_without_a_ledger_entry(self):
+        wallet.deposit(self.user.id, 100)
+        with self.assertRaises(wallet.InsufficientBalance):
+            wallet.pay(self.user.id, 150, self.booking(150))
+        self.assertEqual(wallet.current_balance(self.user.id), 100)
+        self.assertFalse(Transaction.objects.filter(transaction_type='Booking Payment').exists())
+
+    def test_basket_is_paid_with_one_debit(self):
+        wallet.deposit(self.user.id, 500)
+        bookings = [self.booking(100), self.booking(250)]
+        with CaptureQueriesContext(connection) as queries:
+            wallet.pay_many(self.user.id, bookings)
+        debits = [query for query in queries if query['sql'].startswith('UPDATE "hotel_profile"')]
+        self.assertEqual(len(debits), 1)
+        self.assertEqual(wallet.current_balance(self.user.id), 150)
+        self.assertEqual(
+            sorted(Transaction.objects.filter(transaction_type='Booking Payment').values_list('amount', flat=True)),
+            [100, 250],
+        )
+        with self.assertRaises(wallet.InsufficientBalance):
+            wallet.pay_many(self.user.id, [self.booking(100), self.booking(100)])
+        self.assertEqual(wallet.current_balance(self.user.id), 150)
+
+    def test_refund_credits_the_wallet(self):
+        wallet.deposit(self.user.id, 300)
+        booking = self.booking(200)
+        wallet.pay(self.user.id, 200, booking)
+        wallet.refund(self.user.id, 200, booking)
+        self.assertEqual(wallet.current_balance(self.user.id), 300)
+        self.assertEqual(wallet.ledger_balance(self.user.id), 300)
+
+    def test_ledger_balance_from_checkpoints(self):
+        first = wallet.deposit(self.user.id, 100)
+        wallet.pay(self.user.id, 40, self.booking(40))
+        self.assertEqual(wallet.ledger_balance(self.user.id), 60)
+        self.assertEqual(wallet.ledger_balance(self.user.id, up_to=first.id), 100)
+
+        # Only transactions after the checkpoint are summed on top of it
+        WalletCheckpoint.objects.create(user=self.user, balance=1000, last_transaction_id=first.id)
+        self.assertEqual(wallet.ledger_balance(self.user.id), 960)
+        last = wallet.deposit(self.user.id, 10)
+        self.assertEqual(wallet.ledger_balance(self.user.id), 970)
+        self.assertEqual(wallet.ledger_balance(self.user.id, up_to=last.id - 1), 960)
+
+    def test_checkpoints_report_mismatched_wallets(self):
+        wallet.deposit(self.user.id, 100)
+        other = CustomUser.objects.create(email='other@example.com')
+        Profile.objects.create(user=other, wallet_balance=0, phone_number='')
+        wallet.deposit(other.id, 50)
+        Profile.objects.filter(user=other).update(wallet_balance=75)
+
+        later = timezone.now() + wallet.CHECKPOINT_LAG + timedelta(minutes=1)
+        with mock.patch('hotel.wallet.timezone.now', return_value=later):
+            self.assertEqual(wallet.create_checkpoints(), [(other.id, 50, 75)])
+            self.assertEqual(WalletCheckpoint.objects.count(), 2)
+            # Nothing new is settled, so a second run adds no checkpoints
+            wallet.create_checkpoints()
+        self.assertEqual(WalletCheckpoint.objects.count(), 2)
+        self.assertEqual(WalletCheckpoint.objects.get(user=self.user).balance, 100)
+
+    def test_ledger_survives_deleting_a_hotel_after_a_checkpoint(self):
+        wallet.deposit(self.user.id, 1000)
+        wallet.pay(self.user.id, 100, self.booking(100))
+        later = timezone.now() + wallet.CHECKPOINT_LAG + timedelta(minutes=1)
+        with mock.patch('hotel.wallet.timezone.now', return_value=later):
+            self.assertEqual(wallet.create_checkpoints(), [])
+
+        self.hotel.delete()
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(wallet.current_balance(self.user.id), 900)
+        self.assertEqual(wallet.ledger_balance(self.user.id), 900)
+
+        # The user's own ledger and checkpoints still go with the user
+        self.user.delete()
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(WalletCheckpoint.objects.exists())
+
+    def test_transactions_are_append_only(self):
+        deposit = wallet.deposit(self.user.id, 100)
+        deposit.amount = 1000
+        with self.assertRaises(ValueError):
+            deposit.save()
+        self.assertEqual(Transaction.objects.get().amount, 100)
+
+
+class OccupancyIndexTests(TestCase):
+    def setUp(self):
+        self.index = OccupancyIndex()
+        self.hotel = create_hotel()
+        self.check_in = date.today() + timedelta(days=3)
+        self.check_out = self.check_in + timedelta(days=2)
+
+    def assertLoads(self, loads, **kwargs):
+        # A lookup that (re)loads the tree runs the single occupancy query
+        with self.assertNumQueries(loads):
+            return self.index.peak(self.hotel.id, self.check_in, self.check_out, **kwargs)
+
+    def test_tree_matches_a_brute_force_sweep(self):
+        rng = random.Random(7)
+        start = date.today()
+        tree = OccupancyTree(start, 45)
+        nights = [0] * 45
+        for _ in range(300):
+            lo = rng.randrange(-5, 50)
+            hi = lo + rng.randrange(0, 15)
+            rooms = rng.randrange(-3, 6)
+            tree.add(start + timedelta(days=lo), start + timedelta(days=hi), rooms)
+            for night in range(max(lo, 0), min(hi, 45)):
+                nights[night] += rooms
+
+            a = rng.randrange(0, 45)
+            b = rng.randrange(a, 46)
+            expected = max(nights[a:b]) if b > a else 0
+            self.assertEqual(tree.max(start + timedelta(days=a), start + timedelta(days=b)), expected)
+
+    def test_trees_expire_on_version_ttl_and_hold_expiry(self):
+        self.assertLoads(1, version=1)
+        self.assertLoads(0, version=1)
+        self.assertLoads(1, version=2)
+
+        later = time.monotonic() + self.index.ttl + 1
+        with mock.patch('hotel.occupancy.time.monotonic', return_value=later):
+            self.assertLoads(1)
+
+        user = CustomUser.objects.create(email='holder@example.com')
+        RoomHold.objects.create(
+            user=user, hotel=self.hotel, check_in=self.check_in, check_out=self.check_out,
+            rooms=2, expires_at=timezone.now() + timedelta(minutes=10),
+        )
+        self.index.invalidate(self.hotel.id)
+        self.assertEqual(self.assertLoads(1), 2)
+        self.assertEqual(self.assertLoads(0), 2)
+        with mock.patch('hotel.occupancy.timezone.now', return_value=timezone.now() + timedelta(minutes=11)):
+            self.assertEqual(self.assertLoads(1), 0)
+
+    def test_verify_drops_a_tree_that_disagrees_with_the_ledger(self):
+        self.assertLoads(1)
+        self.assertTrue(self.index.verify(self.hotel.id))
+
+        self.index.apply(self.hotel.id, self.check_in, self.check_out, 3)
+        self.assertFalse(self.index.verify(self.hotel.id))
+        self.assertEqual(self.assertLoads(1), 0)
+
+    def test_changes_applied_during_a_load_are_not_lost(self):
+        # A booking whose apply() lands while the tree is being built: the
+        # tree can't tell whether its query saw the booking, so it isn't kept
+        def build_tree(*args):
+            self.index.apply(self.hotel.id, self.check_in, self.check_out, 1)
+            return OccupancyTree(*args)
+
+        with mock.patch('hotel.occupancy.OccupancyTree', side_effect=build_tree):
+            self.assertLoads(1)
+        self.assertLoads(1)
+        self.assertLoads(0)
+
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.hotel = create_hotel(total_rooms=2)
+        self.check_in = date.today() + timedelta(days=3)
+        self.check_out = self.check_in + timedelta(days=2)
+
+    def sold(self):
+        return list(RoomInventory.objects.filter(hotel=self.hotel).order_by('date').values_list('rooms_sold', flat=True))
+
+    def test_last_room_is_reserved_once(self):
+        reserve_rooms(self.hotel, self.check_in, self.check_out, 1)
+        # Overlaps the second night only, which then has no rooms left
+        reserve_rooms(self.hotel, self.check_in + timedelta(days=1), self.check_out + timedelta(days=1), 1)
+        with self.assertRaises(NotEnoughRooms):
+            reserve_rooms(self.hotel, self.check_in, self.check_out, 1)
+        self.assertEqual(self.sold(), [1, 2, 1])
+
+    def test_release_never_goes_below_zero(self):
+        reserve_rooms(self.hotel, self.check_in, self.check_out, 1)
+        release_rooms(self.hotel, self.check_in, self.check_out, 1)
+        self.assertEqual(self.sold(), [0, 0])
+        # A booking that was never counted (admin, import) can still be released
+        release_rooms(self.hotel, self.check_in, self.check_out, 2)
+        self.assertEqual(self.sold(), [0, 0])
+
+    def test_rebuild_matches_the_live_bookings(self):
+        user = CustomUser.objects.create(email='guest@example.com')
+        other = create_hotel(name='Other')
+        stays = [
+            (self.hotel, self.check_in, self.check_out, 1, 'booked'),
+            (self.hotel, self.check_in + timedelta(days=1), self.check_out + timedelta(days=2), 1, 'booked'),
+            (self.hotel, self.check_in, self.check_out, 1, 'cancelled'),
+            (other, self.check_in, self.check_out, 2, 'booked'),
+        ]
+        for hotel, check_in, check_out, rooms, status in stays:
+            Booking.objects.create(
+                user=user, hotel=hotel, check_in=check_in, check_out=check_out, rooms=rooms,
+                status=status, total_price=100,
+            )
+        RoomInventory.objects.create(hotel=self.hotel, date=self.check_in - timedelta(days=1), rooms_sold=5)
+
+        call_command('rebuild_inventory', stdout=mock.MagicMock())
+        expected = count_rooms_sold(
+            (hotel.id, check_in, check_out, rooms) for hotel, check_in, check_out, rooms, status in stays
+            if status == 'booked'
+        )
+        ledger = {(row.hotel_id, row.date): row.rooms_sold for row in RoomInventory.objects.all()}
+        self.assertEqual(ledger, dict(expected))
+
+        # Rebuilding one hotel leaves the others alone
+        RoomInventory.objects.filter(hotel=other).update(rooms_sold=0)
+        rebuild_inventory([self.hotel.id])
+        self.assertEqual(set(RoomInventory.objects.filter(hotel=other).values_list('rooms_sold', flat=True)), {0})
+
+
+class ReviewStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hotel = create_hotel()
+        self.clients = []
+        for email in ['first@example.com', 'second@example.com']:
+            client = APIClient()
+            client.force_authenticate(CustomUser.objects.create(email=email))
+            self.clients.append(client)
+
+    def stats(self):
+        self.hotel.refresh_from_db()
+        return [getattr(self.hotel, field) for field in STATS_FIELDS]
+
+    def assertStatsMatchRecompute(self):
+        stored = self.stats()
+        recompute_review_stats()
+        self.assertEqual(stored, self.stats())
+        return stored
+
+    def test_posts_edits_and_deletes_keep_stats_exact(self):
+        url = f'/hotels/{self.hotel.id}/reviews/'
+        first = self.clients[0].post(url, {'rating': 5, 'comment': 'Great'}, format='json').json()
+        self.clients[1].post(url, {'rating': 2}, format='json')
+        self.assertEqual(self.assertStatsMatchRecompute()[:3], [2, 7, 5])
+
+        self.assertEqual(self.clients[0].put(f"{url}{first['id']}/", {'rating': 3}, format='json').status_code, 200)
+        self.assertEqual(self.assertStatsMatchRecompute()[:3], [2, 5, 3])
+
+        # Someone else's review can't be touched, and a review is only
+        # removed from the stats by the delete that actually removed it
+        self.assertEqual(self.clients[1].delete(f"{url}{first['id']}/").status_code, 404)
+        self.assertEqual(self.clients[0].delete(f"{url}{first['id']}/").status_code, 204)
+        self.assertEqual(self.clients[0].delete(f"{url}{first['id']}/").status_code, 404)
+        self.assertEqual(self.assertStatsMatchRecompute()[:3], [1, 2, 2])
+
+    def test_a_review_deleted_meanwhile_is_not_counted_twice(self):
+        url = f'/hotels/{self.hotel.id}/reviews/'
+        review = self.clients[0].post(url, {'rating': 4}, format='json').json()
+
+        def deleted_by_another_request(**lookup):
+            found = Review.objects.get(**lookup)
+            Review.objects.filter(pk=found.pk).delete()
+            update_review_stats(found.hotel_id, removed=found.rating)
+            return found
+
+        locked = mock.Mock(get=deleted_by_another_request)
+        with mock.patch.object(Review.objects, 'select_for_update', return_value=locked):
+            self.assertEqual(self.clients[0].delete(f"{url}{review['id']}/").status_code, 204)
+        self.assertEqual(self.assertStatsMatchRecompute()[:2], [0, 0])
+
+    def test_editing_a_hotel_keeps_stats_updated_meanwhile(self):
+        admin = APIClient()
+        admin.force_authenticate(CustomUser.objects.create(email='admin@example.com', is_superuser=True))
+        author = CustomUser.objects.get(email='first@example.com')
+        is_valid = serializers.HotelSerializer.is_valid
+
+        def reviewed_meanwhile(serializer, **kwargs):
+            # A review lands after the PUT loaded the hotel
+            Review.objects.create(user=author, hotel=self.hotel, rating=4)
+            update_review_stats(self.hotel.id, added=4)
+            return is_valid(serializer, **kwargs)
+
+        with mock.patch.object(serializers.HotelSerializer, 'is_valid', reviewed_meanwhile):
+            response = admin.put(f'/hotel-details/{self.hotel.id}/', {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.assertStatsMatchRecompute()[:3], [1, 4, 4])
+        self.assertEqual(self.hotel.name, 'Renamed')
+
+
+class HotelCalendarTests(TestCase):
+    def setUp(self):
+        self.hotel = create_hotel(total_rooms=3)
+        self.user = CustomUser.objects.create(email='guest@example.com')
+
+    def calendar(self, **query):
+        return self.client.get(f'/hotels/{self.hotel.id}/calendar/', query)
+
+    def test_months_roll_over_the_year_and_count_holds(self):
+        Booking.objects.create(
+            user=self.user, hotel=self.hotel, check_in=date(2030, 12, 30), check_out=date(2031, 1, 2),
+            rooms=2, total_price=600,
+        )
+        Booking.objects.create(
+            user=self.user, hotel=self.hotel, check_in=date(2030, 12, 30), check_out=date(2031, 1, 2),
+            rooms=1, total_price=300, status='cancelled',
+        )
+        hold = {'user': self.user, 'hotel': self.hotel, 'check_in': date(2031, 1, 1), 'check_out': date(2031, 1, 3)}
+        RoomHold.objects.create(**hold, expires_at=timezone.now() + timedelta(minutes=10))
+        RoomHold.objects.create(**hold, rooms=2, expires_at=timezone.now() - timedelta(minutes=1))
+
+        body = self.calendar(month='2030-11', months=3).json()
+        self.assertEqual((body['start'], body['end']), ('2030-11-01', '2031-02-01'))
+        self.assertEqual(len(body['nights']), 92)
+
+        nights = {night['date']: (night['booked_rooms'], night['available_rooms']) for night in body['nights']}
+        self.assertEqual(nights['2030-12-29'], (0, 3))
+        self.assertEqual(nights['2030-12-30'], (2, 1))
+        self.assertEqual(nights['2031-01-01'], (3, 0))
+        self.assertEqual(nights['2031-01-02'], (1, 2))
+        self.assertEqual(nights['2031-01-03'], (0, 3))
+
+        december = self.calendar(month='2030-12').json()
+        self.assertEqual((december['end'], len(december['nights'])), ('2031-01-01', 31))
+
+    def test_invalid_input(self):
+        for query in [{}, {'month': '2030-13'}, {'month': '2030-12-01'}, {'month': '2030-12', 'months': 0},
+                      {'month': '2030-12', 'months': 13}]:
+            self.assertEqual(self.calendar(**query).status_code, 400, query)
+        self.assertEqual(self.client.get('/hotels/0/calendar/', {'month': '2030-12'}).status_code, 404)
+
+
+class FlexibleSearchTests(TestCase):
+    def test_window_peaks_match_brute_force(self):
+        rng = random.Random(11)
+        for _ in range(200):
+            values = [rng.randrange(0, 8) for _ in range(rng.randrange(0, 30))]
+            width = rng.randrange(1, 8)
+            expected = [max(values[i:i + width]) for i in range(len(values) - width + 1)]
+            self.assertEqual(window_peaks(values, width), expected)
+
+    def test_windows_start_today_at_the_earliest_and_fit_the_rooms(self):
+        today = date.today()
+        hotel = create_hotel(total_rooms=3)
+        Booking.objects.create(
+            user=CustomUser.objects.create(email='guest@example.com'), hotel=hotel,
+            check_in=today + timedelta(days=2), check_out=today + timedelta(days=3), rooms=2, total_price=200,
+        )
+
+        # check_in - flex_days is in the past, so the first window starts today
+        windows = flexible_availability(
+            [hotel], today + timedelta(days=1), today + timedelta(days=3), flex_days=3, rooms_requested=2,
+        )[hotel.id]
+        self.assertEqual(windows, [(today, 3), (today + timedelta(days=3), 3), (today + timedelta(days=4), 3)])
+
+        windows = flexible_availability(
+            [hotel], today + timedelta(days=1), today + timedelta(days=3), flex_days=3, rooms_requested=1,
+        )[hotel.id]
+        self.assertEqual([free for _, free in windows], [3, 1, 1, 3, 3])
+
+
+class LocationAutocompleteTests(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        for name, location in [('A', 'São Paulo'), ('B', 'sao paulo'), ('C', 'Sapporo'), ('D', 'Dhaka'), ('E', None)]:
+            create_hotel(name=name, location=location)
+
+    def suggest(self, q, **query):
+        return self.client.get('/locations/autocomplete/', {'q': q, **query}).json()['results']
+
+    def test_normalize_location(self):
+        self.assertEqual(normalize_location('  São   PAULO '), 'sao paulo')
+        self.assertEqual(normalize_location('Straße'), 'strasse')
+        self.assertEqual(normalize_location(None), '')
+
+    def test_prefix_matching_ignores_case_and_accents(self):
+        self.assertEqual(self.suggest('SÃO'), [{'location': 'São Paulo', 'hotels': 2}])
+        self.assertEqual(self.suggest('sa'), [{'location': 'São Paulo', 'hotels': 2}, {'location': 'Sapporo', 'hotels': 1}])
+        self.assertEqual(
+            sorted(Hotel.objects.location_prefix('SAO P').values_list('name', flat=True)), ['A', 'B'],
+        )
+        self.assertEqual(self.suggest('sao paulo x'), [])
+
+    def test_empty_and_short_prefixes(self):
+        self.assertEqual(self.suggest(''), [])
+        self.assertEqual(self.suggest('   '), [])
+        self.assertEqual([row['location'] for row in self.suggest('s', limit=1)], ['São Paulo'])
+        self.assertEqual(len(self.suggest('d')), 1)
+        response = self.client.get('/locations/autocomplete/', {'q': 's', 'limit': 'many'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(OCCUPANCY_INDEX_ENABLED=False)
+class AggregatedSearchTests(QueryCountMixin, TestCase):
+    # The search path over the inventory ledger, used whenever the
+    # in-memory occupancy index can't answer
+    def setUp(self):
+        caches['throttle'].clear()
+        self.user = CustomUser.objects.create(email='guest@example.com')
+        self.check_in = date.today() + timedelta(days=7)
+        self.check_out = self.check_in + timedelta(days=3)
+        self.query = {
+            'location': 'dhaka', 'check_in': self.check_in, 'check_out': self.check_out,
+            'adults': 3, 'children': 0, 'rooms': 2,
+        }
+        self.add_hotels()
+
+    def add_hotels(self):
+        night = timedelta(days=1)
+        for total_rooms, capacity, stays in [
+            (4, 2, []),
+            (4, 2, [(self.check_in + night, self.check_out, 1), (self.check_in + night, self.check_in + 2 * night, 1)]),
+            (4, 2, [(self.check_in - night, self.check_in + night, 3)]),
+            (4, 1, []),
+        ]:
+            hotel = create_hotel(total_rooms=total_rooms, capacity_per_room=capacity)
+            HotelImage.objects.create(hotel=hotel, image='hotel_images/front.webp')
+            for check_in, check_out, rooms in stays:
+                Booking.objects.create(
+                    user=self.user, hotel=hotel, check_in=check_in, check_out=check_out, rooms=rooms, total_price=100,
+                )
+        create_hotel(location='Chittagong')
+        rebuild_inventory()
+
+    def expected(self):
+        # The per-hotel check search used to run for every candidate
+        results = {}
+        for hotel in Hotel.objects.location_prefix('dhaka'):
+            free = hotel.total_rooms - booked_rooms(hotel, self.check_in, self.check_out)
+            if free >= 2 and 2 * hotel.capacity_per_room >= 3:
+                results[hotel.id] = free
+        return results
+
+    def test_search_matches_per_hotel_checks_in_fixed_queries(self):
+        def found(response):
+            return {hotel['id']: hotel['available_rooms'] for hotel in response.json()['results']}
+
+        before = self.expected()
+        # The index lookup is attempted first, then one aggregated query
+        first, second = self.assertFixedQueries(2, '/search/', self.add_hotels, self.query)
+        self.assertEqual(found(first), before)
+        self.assertEqual(found(second), self.expected())
+        self.assertEqual(sorted(found(second).values()), [2, 2, 4, 4])
 
-# Create your tests here.
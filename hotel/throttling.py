@@ -0,0 +1,120 @@
+import math
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    # A rate of 'N/period' allows bursts of up to N requests, refilled at
+    # N per period, per user (or client IP when anonymous). Buckets live in
+    # the THROTTLE_CACHE alias: a local-memory cache throttles each process
+    # on its own, a shared one (Redis, Memcached) throttles across workers.
+    # Updates are atomic within a process only, so a shared cache may let a
+    # few extra requests through under contention.
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+    _lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+
+    def get_rate(self):
+        # Read per instance (not at import) so rate changes apply at once
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        refill = self.num_requests / self.duration
+
+        with self._lock:
+            now = self.timer()
+            tokens, updated = self.cache.get(key, (self.num_requests, now))
+            tokens = min(self.num_requests, tokens + (now - updated) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Kept until the bucket would be full again anyway
+            self.cache.set(key, (tokens, now), math.ceil(self.duration))
+        self.missing = 0 if allowed else (1 - tokens) / refill
+        return allowed
+
+    def wait(self):
+        return self.missing
+
+
+class SearchThrottle(TokenBucketThrottle):
+    scope = 'search'
+
+
+class BookingThrottle(TokenBucketThrottle):
+    # Only attempts to book count; listing your bookings is not limited
+    scope = 'booking'
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            self.missing = 0
+            return True
+        return super().allow_request(request, view)
+
+
+class Admission:
+    # Per-process concurrency limits by endpoint class. ADMISSION_LIMITS maps
+    # a class to the number of requests in flight (over every class) above
+    # which its new requests are shed with a 503, so a class with a lower
+    # limit is shed first and the difference stays reserved for the others.
+    # The count is per process: it only reaches a limit when one process
+    # serves several requests at once (threaded workers), see WEB_THREADS.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def limit(self, endpoint_class):
+        return getattr(settings, 'ADMISSION_LIMITS', {}).get(endpoint_class)
+
+    def enter(self, endpoint_class):
+        limit = self.limit(endpoint_class)
+        with self._lock:
+            if limit is not None and self.in_flight >= limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+admission = Admission()
+
+
+def admit(endpoint_class):
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not admission.enter(endpoint_class):
+                response = Response({'detail': 'Server is busy, please retry shortly.'}, status=503)
+                response['Retry-After'] = str(getattr(settings, 'ADMISSION_RETRY_AFTER', 1))
+                return response
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                admission.leave()
+        return wrapped
+    return decorator
@@ -24,16 +24,24 @@ urlpatterns = [
 
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/cache-stats/', views.auth_cache_stats, name='auth-cache-stats'),
 
     path('hotels/', views.hotel_list_create, name='hotels'),
     path('hotel-images/', views.hotel_image_list_create, name='hotel-images'),
     path('hotel-details/<int:pk>/', views.hotel_detail, name='hotel-details'),
+    path('hotels/<int:hotel_id>/calendar/', views.hotel_calendar, name='hotel-calendar'),
 
     path('search/', views.search_hotels, name='hotel-search'),
+    path('locations/autocomplete/', views.location_autocomplete, name='location-autocomplete'),
     path('bookings/', views.booking_create, name='bookings'),
+    path('bookings/bulk/', views.booking_bulk_create, name='bookings-bulk'),
+    path('holds/', views.hold_create, name='holds'),
+    path('holds/<uuid:token>/', views.hold_release, name='hold-release'),
     path('cancel-booking/<int:booking_id>/', views.cancel_booking, name='cancel-booking'),
     path('wallet/deposit/', views.wallet_deposit, name='wallet-deposit'),
     path('transactions/', views.user_transactions, name='user-transactions'),
+    path('bookings/export.<str:fmt>', views.booking_export, name='booking-export'),
+    path('transactions/export.<str:fmt>', views.transaction_export, name='transaction-export'),
 
     path('hotels/<int:hotel_id>/reviews/', views.hotel_reviews, name='hotel-reviews'),
     path('hotels/<int:hotel_id>/reviews/<int:review_id>/', views.review_detail, name='review-detail'),
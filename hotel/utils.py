@@ -1,5 +1,5 @@
-from django.conf import settings
-from django.core.mail import EmailMessage
+import unicodedata
+
 from django.template.loader import render_to_string
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
@@ -19,17 +19,9 @@ def send_verification_email(request, user):
         {"user": user, "verification_link": verification_link},
     )
 
-    email = EmailMessage(
-        subject=email_subject,
-        body=email_body,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email],
-    )
-    
-    email.content_subtype = "html"
-    email.send()
-
-from django.core.mail import send_mail
+    # Queued in the outbox; `manage.py send_outbox` delivers it
+    from .outbox import enqueue_email
+    enqueue_email(user.email, email_subject, email_body, content_subtype="html")
 
 
 def send_user_mail(user, subject, message):
@@ -37,15 +29,15 @@ def send_user_mail(user, subject, message):
     if not user.email:
         return False  
     
-    try:
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            fail_silently=False, 
-        )
-        return True
-    except Exception as e:
-        print(f"Email sending failed: {e}")
-        return False
+    from .outbox import enqueue_email
+    enqueue_email(user.email, subject, message)
+    return True
+
+
+def normalize_location(value):
+    # Case-folded, accent-stripped key used for indexed location lookups
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
@@ -1,14 +1,32 @@
 from django.shortcuts import render
-from rest_framework.decorators import api_view,permission_classes
+from rest_framework.decorators import api_view,permission_classes,throttle_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import NotFound
 from .import serializers
-from .models import CustomUser, Profile, Hotel, Booking, HotelImage, Review, Transaction
-from .utils import send_verification_email, send_user_mail
+from .models import CustomUser, Profile, Hotel, Booking, HotelImage, Review, RoomHold, Transaction
+from .utils import normalize_location, send_verification_email, send_user_mail
+from . import wallet
+from .auth import user_cache
+from .booking import BookingError, book_hold, book_stay, book_stays, cancel_stay, hold_rooms, release_hold
+from .cache import CATALOGUE, cached_response, hotel_scope
+from .export import CONTENT_TYPES, export_lines, export_queryset
+from .images import variant_url
+from .pagination import InvalidCursor, paginate_keyset
+from .review_stats import update_review_stats
+from .throttling import BookingThrottle, SearchThrottle, admit
+from .occupancy import (
+    OccupancyIndexUnavailable, flexible_availability, nightly_occupancy, occupancy_index, overlapping_stays,
+)
 from django.utils.http import urlsafe_base64_decode
 from django.contrib.auth.tokens import default_token_generator
+import uuid
+from datetime import date, timedelta
 from decimal import Decimal
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Count, Min, Prefetch
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
@@ -33,17 +51,18 @@ def user_registration(request):
     if request.method == 'POST':
         serializer = serializers.UserSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save(is_active=False)
-
-            #create associated profile
-            Profile.objects.create(
-                user=user,
-                phone_number=request.data.get('phone_number', ''),
-                wallet_balance=0.00,
-                email_verified=False
-            )
+            with transaction.atomic():
+                user = serializer.save(is_active=False)
+
+                #create associated profile
+                Profile.objects.create(
+                    user=user,
+                    phone_number=request.data.get('phone_number', ''),
+                    wallet_balance=0.00,
+                    email_verified=False
+                )
 
-            send_verification_email(request, user)
+                send_verification_email(request, user)
 
             return Response({'detail': 'User registered successfully. Please check your email to verify your account.'}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -95,13 +114,18 @@ def user_profile(request):
     if not request.user.is_authenticated:
         return Response({'detail': 'Authentication required'}, status=401)
     
-    profile = Profile.objects.get(user=request.user)
-    
     if request.method == 'GET':
+        # The rest of the profile comes with the (possibly cached) user; the
+        # balance is always read from the database
+        profile = request.user.profile
+        profile.wallet_balance = wallet.current_balance(request.user.id)
         serializer = serializers.ProfileSerializer(profile)
         return Response(serializer.data)
     
     elif request.method == 'PUT':
+        # save() writes every column, so start from the current row rather
+        # than the cached snapshot
+        profile = Profile.objects.select_related('user').get(user=request.user)
         serializer = serializers.ProfileSerializer(profile, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
@@ -110,8 +134,20 @@ def user_profile(request):
     return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+def requested_fields(request):
+    fields = request.GET.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
 @swagger_auto_schema(
     method='get',
+    manual_parameters=[
+        openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Cursor from the previous page'),
+        openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description='Hotels per page'),
+        openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Comma-separated fields to return'),
+    ],
     responses={200: serializers.HotelSerializer(many=True)}
 )
 @swagger_auto_schema(
@@ -123,9 +159,18 @@ def user_profile(request):
 @permission_classes([AllowAny])
 def hotel_list_create(request):
     if request.method == 'GET':
-        hotels = Hotel.objects.all()
-        serializer = serializers.HotelSerializer(hotels, many=True, context={'request': request})
-        return Response(serializer.data)
+        def build():
+            fields = requested_fields(request)
+            hotels, next_url = paginate_keyset(request, Hotel.objects.for_listing(fields))
+            serializer = serializers.HotelSerializer(
+                hotels, many=True, context={'request': request}, fields=fields
+            )
+            return {'next': next_url, 'results': serializer.data}
+
+        try:
+            return cached_response(request, [CATALOGUE], build)
+        except InvalidCursor as e:
+            return Response({'detail': str(e)}, status=400)
     
     elif request.method == 'POST':
         if not request.user.is_authenticated:
@@ -140,7 +185,14 @@ def hotel_list_create(request):
 
 @swagger_auto_schema(
     method='get',
-    responses={200: serializers.HotelImageSerializer(many=True)}
+    manual_parameters=[
+        openapi.Parameter('hotel_id', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description='Only images of this hotel'),
+        openapi.Parameter('mode', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['full', 'lean'],
+                          description='lean drops the embedded hotel (default full)'),
+        openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Cursor from the previous page'),
+        openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description='Images per page'),
+    ],
+    responses={200: serializers.HotelImageSerializer(many=True), 400: 'Invalid hotel_id, mode or cursor'}
 )
 @swagger_auto_schema(
     method='post',
@@ -150,9 +202,32 @@ def hotel_list_create(request):
 @api_view(['GET', 'POST'])
 def hotel_image_list_create(request):
     if request.method == 'GET':
+        mode = request.GET.get('mode', 'full')
+        if mode not in ('full', 'lean'):
+            return Response({'detail': 'mode must be full or lean'}, status=400)
+
         images = HotelImage.objects.all()
-        serializer = serializers.HotelImageSerializer(images, many=True)
-        return Response(serializer.data)
+        if 'hotel_id' in request.GET:
+            try:
+                images = images.filter(hotel_id=int(request.GET['hotel_id']))
+            except ValueError:
+                return Response({'detail': 'Invalid hotel_id'}, status=400)
+
+        if mode == 'lean':
+            # One query per page: only HotelImage's own columns are read
+            images = images.only('id', 'hotel_id', 'image', 'alt_text', 'variants')
+            serializer_class = serializers.HotelImageLeanSerializer
+        else:
+            images = images.prefetch_related(Prefetch('hotel', queryset=Hotel.objects.for_listing()))
+            serializer_class = serializers.HotelImageSerializer
+
+        # Oldest first, so a hotel's gallery keeps upload order
+        try:
+            page, next_url = paginate_keyset(request, images, keys=('id',), ascending=True)
+        except InvalidCursor as e:
+            return Response({'detail': str(e)}, status=400)
+        serializer = serializer_class(page, many=True, context={'request': request})
+        return Response({'next': next_url, 'results': serializer.data})
     
     elif request.method == 'POST':
         if not request.user.is_authenticated:
@@ -181,15 +256,21 @@ def hotel_image_list_create(request):
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([AllowAny])
 def hotel_detail(request, pk):
+    if request.method == 'GET':
+        def build():
+            try:
+                hotel = Hotel.objects.for_listing().get(pk=pk)
+            except Hotel.DoesNotExist:
+                raise NotFound('Hotel not found')
+            return serializers.HotelSerializer(hotel, context={'image_variant': 'full'}).data
+
+        return cached_response(request, [hotel_scope(pk)], build)
+
     try:
-        hotel = Hotel.objects.get(pk=pk)
+        hotel = Hotel.objects.for_listing().get(pk=pk)
     except Hotel.DoesNotExist:
         return Response({'detail': 'Hotel not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    if request.method == 'GET':
-        serializer = serializers.HotelSerializer(hotel)
-        return Response(serializer.data)
-    
     if request.user.is_superuser:
         if request.method == 'PUT':
             serializer = serializers.HotelSerializer(hotel, data=request.data, partial=True)
@@ -203,38 +284,51 @@ def hotel_detail(request, pk):
             return Response(status=status.HTTP_204_NO_CONTENT)
         
 
-def helper_functions(hotel, check_in, check_out, adults, children, rooms_requested):
-    # 1. Overlapping bookings check
-    overlapping_bookings = Booking.objects.filter(
-        hotel=hotel,
-        check_in__lt=check_out,
-        check_out__gt=check_in,
-        status='booked'
-    )
-    booked_rooms = sum(b.rooms for b in overlapping_bookings)
-    available_rooms = hotel.total_rooms - booked_rooms
-    if available_rooms < rooms_requested:
-        return False, 'Not enough rooms available for the selected dates.'
-
-    # 2. Capacity check
-    total_capacity = rooms_requested * hotel.capacity_per_room
-    if (adults + children) > total_capacity:
-        return False, 'Selected rooms cannot accommodate the number of guests.'
-      
-    return True, {
-        "available_rooms": available_rooms,
-        "capacity_per_room": hotel.capacity_per_room,
-        "price_per_night": hotel.price_per_night
-    }
+def flexible_search(hotels, check_in, check_out, adults, children, rooms_requested, flex_days):
+    candidates = list(hotels.fits_guests(adults, children, rooms_requested).with_first_image())
+    availability = flexible_availability(candidates, check_in, check_out, flex_days, rooms_requested)
+    stay = check_out - check_in
+
+    available_hotels = []
+    for hotel in candidates:
+        windows = availability[hotel.id]
+        if not windows:
+            continue
+        # Nightly prices are flat, so every window costs the same and the
+        # earliest one is reported as the cheapest
+        total_price = hotel.price_per_night * rooms_requested * stay.days
+        cheapest_start, _ = windows[0]
+        available_hotels.append({
+            "id": hotel.id,
+            "name": hotel.name,
+            "location": hotel.location,
+            "image": (f"http://127.0.0.1:8000{variant_url(hotel.first_image, hotel.first_image_variants, 'card')}" if hotel.first_image else None),
+            "capacity_per_room": hotel.capacity_per_room,
+            "price_per_night": hotel.price_per_night,
+            "cheapest": {
+                "check_in": cheapest_start,
+                "check_out": cheapest_start + stay,
+                "total_price": total_price,
+            },
+            "available_dates": [
+                {"check_in": start, "check_out": start + stay, "available_rooms": free_rooms}
+                for start, free_rooms in windows
+            ],
+        })
+
+    available_hotels.sort(key=lambda result: result['cheapest']['total_price'])
+    return Response({"results": available_hotels}, status=200)
 
 
 @swagger_auto_schema(
     method='get',
     query_serializer=serializers.HotelSearchSerializer,
-    responses={200: 'List of available hotels', 400: 'Validation error'}
+    responses={200: 'List of available hotels', 400: 'Validation error', 429: 'Too many requests', 503: 'Server busy'}
 )
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes([SearchThrottle])
+@admit('search')
 def search_hotels(request):
     serializer = serializers.HotelSearchSerializer(data=request.GET.dict())
     if serializer.is_valid():
@@ -244,25 +338,43 @@ def search_hotels(request):
         adults = serializer.validated_data['adults']
         children = serializer.validated_data['children']
         rooms_requested = serializer.validated_data['rooms']
-
-        # Filter hotels by location
-        hotels = Hotel.objects.filter(location__icontains=location)
+        flex_days = serializer.validated_data['flex_days']
+
+        hotels = Hotel.objects.location_prefix(location)
+        if flex_days:
+            return flexible_search(hotels, check_in, check_out, adults, children, rooms_requested, flex_days)
+
+        # Filter hotels by location and capacity, then check availability
+        # against the in-memory occupancy index
+        try:
+            candidates = list(
+                hotels.fits_guests(adults, children, rooms_requested).with_first_image()
+                .with_inventory_version()
+            )
+            peaks = occupancy_index.peaks(
+                [hotel.id for hotel in candidates], check_in, check_out,
+                {hotel.id: hotel.inventory_version for hotel in candidates},
+            )
+            for hotel in candidates:
+                hotel.free_rooms = hotel.total_rooms - peaks[hotel.id]
+            hotels = [hotel for hotel in candidates if hotel.free_rooms >= rooms_requested]
+        except OccupancyIndexUnavailable:
+            # Fall back to a single aggregated query over the inventory ledger
+            hotels = hotels.available_for(
+                check_in, check_out, adults, children, rooms_requested
+            ).with_first_image()
         available_hotels = []
 
         for hotel in hotels:
-            is_available, data = helper_functions(hotel, check_in, check_out, adults, children, rooms_requested)
-
-            # Add hotel to results
-            if is_available:
-                available_hotels.append({
-                    "id": hotel.id,
-                    "name": hotel.name,
-                    "location": hotel.location,
-                    "image": (f"http://127.0.0.1:8000{hotel.images.first().image.url}" if hotel.images.exists() else None),
-                    "available_rooms": data['available_rooms'],
-                    "capacity_per_room": data['capacity_per_room'],
-                    "price_per_night": data['price_per_night']
-                })
+            available_hotels.append({
+                "id": hotel.id,
+                "name": hotel.name,
+                "location": hotel.location,
+                "image": (f"http://127.0.0.1:8000{variant_url(hotel.first_image, hotel.first_image_variants, 'card')}" if hotel.first_image else None),
+                "available_rooms": hotel.free_rooms,
+                "capacity_per_room": hotel.capacity_per_room,
+                "price_per_night": hotel.price_per_night
+            })
 
         return Response({"results": available_hotels}, status=200)
 
@@ -272,23 +384,133 @@ def search_hotels(request):
 
 @swagger_auto_schema(
     method='get',
-    responses={200: serializers.BookingSerializer(many=True), 401: 'Authentication required'}
+    query_serializer=serializers.HotelCalendarSerializer,
+    responses={200: 'Free rooms per night', 400: 'Validation error', 404: 'Hotel not found'}
+)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def hotel_calendar(request, hotel_id):
+    try:
+        hotel = Hotel.objects.get(id=hotel_id)
+    except Hotel.DoesNotExist:
+        return Response({'detail': 'Hotel not found'}, status=404)
+
+    serializer = serializers.HotelCalendarSerializer(data=request.GET.dict())
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=400)
+
+    start = serializer.validated_data['month']
+    months = serializer.validated_data['months']
+    year, month = divmod(start.month - 1 + months, 12)
+    end = date(start.year + year, month + 1, 1)
+
+    # One query for every booking touching the range, then a single sweep
+    stays = overlapping_stays([hotel.id], start, end)
+    occupancy = nightly_occupancy(
+        ((check_in, check_out, rooms) for _, check_in, check_out, rooms in stays),
+        start, end,
+    )
+
+    total_rooms = hotel.total_rooms or 0
+    nights = [
+        {
+            "date": start + timedelta(days=i),
+            "booked_rooms": booked,
+            "available_rooms": max(total_rooms - booked, 0),
+        }
+        for i, booked in enumerate(occupancy)
+    ]
+    return Response({
+        "hotel_id": hotel.id,
+        "total_rooms": hotel.total_rooms,
+        "start": start,
+        "end": end,
+        "nights": nights,
+    }, status=200)
+
+
+@swagger_auto_schema(
+    method='get',
+    manual_parameters=[
+        openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Location prefix'),
+        openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description='Maximum suggestions (default 10)'),
+    ],
+    responses={200: 'Matching locations', 429: 'Too many requests', 503: 'Server busy'}
+)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([SearchThrottle])
+@admit('search')
+def location_autocomplete(request):
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        return Response({'detail': 'Invalid limit'}, status=400)
+
+    if not normalize_location(query):
+        return Response({"results": []}, status=200)
+
+    # Grouped on the indexed key, so this is a range scan over matching locations only
+    locations = (
+        Hotel.objects.location_prefix(query)
+        .values('location_key')
+        .annotate(location=Min('location'), hotels=Count('id'))
+        .order_by('location_key')[:limit]
+    )
+    results = [{"location": row['location'], "hotels": row['hotels']} for row in locations]
+    return Response({"results": results}, status=200)
+
+
+@swagger_auto_schema(
+    method='get',
+    manual_parameters=[
+        openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Cursor from the previous page'),
+        openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description='Bookings per page'),
+    ],
+    responses={200: 'Page of bookings, newest first, with the next page URL', 401: 'Authentication required'}
 )
 @swagger_auto_schema(
     method='post',
     request_body=serializers.BookingSerializer,
-    responses={201: 'Booking created', 400: 'Validation error / Insufficient balance'}
+    responses={201: 'Booking created', 400: 'Validation error / Insufficient balance / Hold expired', 429: 'Too many requests', 503: 'Server busy'}
 )
 @api_view(['POST', 'GET'])
+@throttle_classes([BookingThrottle])
+@admit('booking')
 def booking_create(request):
     if not request.user.is_authenticated:
         return Response({'detail': 'Authentication required'}, status=401)
     if request.method == 'GET':
-        
-        bookings = Booking.objects.filter(user=request.user)
+        try:
+            bookings, next_url = paginate_keyset(
+                request, Booking.objects.filter(user=request.user).select_related('hotel')
+            )
+        except InvalidCursor as e:
+            return Response({'detail': str(e)}, status=400)
         serializer = serializers.BookingSerializer(bookings, many=True)
-        return Response(serializer.data)
+        return Response({'next': next_url, 'results': serializer.data})
     
+    elif request.method == 'POST' and request.data.get('hold_token'):
+        # Pay for rooms set aside earlier with POST /holds/
+        try:
+            token = uuid.UUID(str(request.data['hold_token']))
+        except ValueError:
+            return Response({'detail': 'Invalid hold token'}, status=400)
+
+        try:
+            booking = book_hold(request.user, token)
+        except BookingError as e:
+            return Response({'detail': str(e)}, status=400)
+
+        return Response(
+            {
+                'detail': 'Booking created successfully.',
+                'booking_id': booking.id
+            },
+            status=status.HTTP_201_CREATED
+        )
+
     elif request.method == 'POST':
         serializer = serializers.BookingSerializer(data=request.data)
         if serializer.is_valid():
@@ -299,48 +521,12 @@ def booking_create(request):
             children = serializer.validated_data.get('children', 0)
             rooms_requested = serializer.validated_data.get('rooms', 1)
 
-            is_available, data =helper_functions(hotel, check_in, check_out, adults, children, rooms_requested)
-        
-            if not is_available:
-                 return Response({'detail': data}, status=400)
-
-            # Create booking
-            nights = (check_out - check_in).days
-            total_price = hotel.price_per_night * rooms_requested * nights
-
-            profile = request.user.profile
-
-            if profile.wallet_balance < total_price:
-                return Response({'detail': 'Insufficient wallet balance.'}, status=400)
-            
-            profile.wallet_balance -= total_price
-            profile.save()
-
-            booking = Booking.objects.create(
-                user=request.user,
-                hotel=hotel,
-                check_in=check_in,
-                check_out=check_out,
-                adults=adults,
-                children=children,
-                rooms=rooms_requested,
-                total_price=total_price,
-                status='booked'
-            )
-
-            Transaction.objects.create(
-                user=request.user,
-                booking=booking,
-                amount=total_price,
-                transaction_type="Booking Payment"
-            )
-
-            send_user_mail(
-                request.user,
-                "Booking Confirmed",
-                f"Dear {request.user.first_name}, your booking for {hotel.name} "
-                f"from {check_in} to {check_out} is confirmed.\nTotal Paid: {total_price}."
-            )
+            try:
+                booking = book_stay(
+                    request.user, hotel, check_in, check_out, adults, children, rooms_requested
+                )
+            except BookingError as e:
+                return Response({'detail': str(e)}, status=400)
 
             return Response(
                 {
@@ -352,7 +538,98 @@ def booking_create(request):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    
+
+
+@swagger_auto_schema(
+    method='post',
+    request_body=serializers.RoomHoldSerializer,
+    responses={201: serializers.RoomHoldSerializer, 400: 'Validation error / Not enough rooms', 401: 'Authentication required', 429: 'Too many requests', 503: 'Server busy'}
+)
+@api_view(['POST'])
+@throttle_classes([BookingThrottle])
+@admit('booking')
+def hold_create(request):
+    if not request.user.is_authenticated:
+        return Response({'detail': 'Authentication required'}, status=401)
+
+    serializer = serializers.RoomHoldSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        hold = hold_rooms(
+            request.user,
+            serializer.validated_data['hotel'],
+            serializer.validated_data['check_in'],
+            serializer.validated_data['check_out'],
+            serializer.validated_data.get('adults', 1),
+            serializer.validated_data.get('children', 0),
+            serializer.validated_data.get('rooms', 1),
+        )
+    except BookingError as e:
+        return Response({'detail': str(e)}, status=400)
+
+    return Response(serializers.RoomHoldSerializer(hold).data, status=status.HTTP_201_CREATED)
+
+
+@swagger_auto_schema(
+    method='delete',
+    responses={204: 'Hold released', 404: 'Hold not found or expired', 401: 'Authentication required'}
+)
+@api_view(['DELETE'])
+def hold_release(request, token):
+    if not request.user.is_authenticated:
+        return Response({'detail': 'Authentication required'}, status=401)
+
+    hold = RoomHold.objects.active().filter(token=token, user=request.user).first()
+    if hold is None or not release_hold(hold):
+        return Response({'detail': 'Hold not found or expired'}, status=404)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@swagger_auto_schema(
+    method='post',
+    request_body=serializers.BulkBookingSerializer,
+    responses={
+        201: 'Per-stay results, at least one stay booked',
+        400: 'Validation error / No stay could be booked',
+        401: 'Authentication required',
+        429: 'Too many requests',
+        503: 'Server busy',
+    }
+)
+@api_view(['POST'])
+@throttle_classes([BookingThrottle])
+@admit('booking')
+def booking_bulk_create(request):
+    if not request.user.is_authenticated:
+        return Response({'detail': 'Authentication required'}, status=401)
+
+    serializer = serializers.BulkBookingSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        outcomes = book_stays(
+            request.user,
+            serializer.validated_data['stays'],
+            serializer.validated_data['all_or_nothing'],
+        )
+    except BookingError as e:
+        return Response({'detail': str(e)}, status=400)
+
+    results = [
+        {'booking_id': booking.id, 'total_price': booking.total_price, 'status': 'booked'}
+        if booking else {'status': 'rejected', 'detail': error}
+        for booking, error in outcomes
+    ]
+    booked = sum(1 for booking, _ in outcomes if booking)
+    return Response(
+        {'booked': booked, 'rejected': len(outcomes) - booked, 'results': results},
+        status=status.HTTP_201_CREATED if booked else status.HTTP_400_BAD_REQUEST
+    )
+
+
 @swagger_auto_schema(
     method='post',
     responses={200: 'Booking cancelled and refunded', 404: 'Booking not found', 400: 'Already cancelled'}
@@ -366,30 +643,8 @@ def cancel_booking(request, booking_id):
     except Booking.DoesNotExist:
         return Response({'detail': 'Booking not found'}, status=404)
     
-    if booking.status == 'cancelled':
+    if booking.status == 'cancelled' or not cancel_stay(booking):
         return Response({'detail': 'Booking is already cancelled'}, status=400)
-    
-    
-    booking.status = 'cancelled'
-    booking.save()
-    
-    profile = request.user.profile
-    profile.wallet_balance += booking.total_price
-    profile.save()
-
-    Transaction.objects.create(
-        user=request.user,
-        booking=booking,
-        amount=booking.total_price,
-        transaction_type='Refund'
-    )
-    send_user_mail(
-        request.user,
-        "Booking Cancelled & Refund Processed",
-        f"Dear {request.user.first_name}, your booking at {booking.hotel.name} "
-        f"has been cancelled.\nRefund Amount: {booking.total_price} added back "
-        f"to your wallet.\nNew Balance: {profile.wallet_balance}."
-    )
 
     return Response({'detail': 'Booking cancelled and amount refunded'}, status=200)
     
@@ -415,23 +670,18 @@ def wallet_deposit(request):
     if amount <= 500:
         return Response({'detail': 'Deposit amount must be  greater than or equal 500'}, status=400)
     
-    profile = request.user.profile
-    profile.wallet_balance += amount
-    profile.save()
-    Transaction.objects.create(
-        user=request.user,
-        amount=amount,
-        transaction_type='Deposit'
-    )
+    with transaction.atomic():
+        wallet.deposit(request.user.id, amount)
+        new_balance = wallet.current_balance(request.user.id)
 
-    send_user_mail(
-        request.user,
-        "Wallet Deposit Successful",
-        f"Dear {request.user.first_name}, your deposit of {amount} was successful.\n"
-        f"Your new wallet balance is {profile.wallet_balance}."
-    )
+        send_user_mail(
+            request.user,
+            "Wallet Deposit Successful",
+            f"Dear {request.user.first_name}, your deposit of {amount} was successful.\n"
+            f"Your new wallet balance is {new_balance}."
+        )
 
-    return Response({'detail': 'Deposit successful', 'new_balance': profile.wallet_balance}, status=200)
+    return Response({'detail': 'Deposit successful', 'new_balance': new_balance}, status=200)
 
 
 permission_classes([AllowAny])
@@ -446,23 +696,29 @@ permission_classes([AllowAny])
 )
 @api_view(['GET', 'POST'])
 def hotel_reviews(request, hotel_id):
+    if request.method == 'GET':
+        def build():
+            if not Hotel.objects.filter(id=hotel_id).exists():
+                raise NotFound('Hotel not found')
+            reviews = Review.objects.filter(hotel_id=hotel_id)
+            return serializers.ReviewSerializer(reviews, many=True).data
+
+        return cached_response(request, [hotel_scope(hotel_id)], build)
+
     try:
         hotel = Hotel.objects.get(id=hotel_id)
     except Hotel.DoesNotExist:
         return Response({'detail': 'Hotel not found'}, status=404)
 
-    if request.method == 'GET':
-        reviews = Review.objects.filter(hotel=hotel)
-        serializer = serializers.ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
-
     # POST (add review)
     if not request.user.is_authenticated:
         return Response({'detail': 'Authentication required'}, status=401)
 
     serializer = serializers.ReviewSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save(user=request.user, hotel=hotel)
+        with transaction.atomic():
+            review = serializer.save(user=request.user, hotel=hotel)
+            update_review_stats(hotel.id, added=review.rating)
         return Response(serializer.data, status=201)
     return Response(serializer.errors, status=400)
 
@@ -481,32 +737,108 @@ def review_detail(request, hotel_id, review_id):
     if not request.user.is_authenticated:
         return Response({'detail': 'Authentication required'}, status=401)
     
-    try:
-        review = Review.objects.get(id=review_id, user=request.user, hotel_id=hotel_id)
-    except Review.DoesNotExist:
-        return Response({'detail': 'Review not found or not authorized'}, status=404)
+    # The review is re-read under a row lock inside the transaction, so two
+    # concurrent changes to it can't both apply their delta to the stats
+    with transaction.atomic():
+        try:
+            review = Review.objects.select_for_update().get(id=review_id, user=request.user, hotel_id=hotel_id)
+        except Review.DoesNotExist:
+            return Response({'detail': 'Review not found or not authorized'}, status=404)
 
-    if request.method == 'PUT':
-        serializer = serializers.ReviewSerializer(review, data=request.data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
+        if request.method == 'PUT':
+            previous_rating = review.rating
+            serializer = serializers.ReviewSerializer(review, data=request.data, partial=True)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=400)
+            review = serializer.save()
+            if review.rating != previous_rating:
+                update_review_stats(review.hotel_id, removed=previous_rating, added=review.rating)
             return Response(serializer.data)
-        return Response(serializer.errors, status=400)
 
-    elif request.method == 'DELETE':
-        review.delete()
-        return Response({'detail': 'Review deleted successfully'}, status=204)
+        elif request.method == 'DELETE':
+            deleted, _ = Review.objects.filter(pk=review.pk).delete()
+            if deleted:
+                update_review_stats(review.hotel_id, removed=review.rating)
+            return Response({'detail': 'Review deleted successfully'}, status=204)
     return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@swagger_auto_schema(
+    method='get',
+    manual_parameters=[
+        openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Cursor from the previous page'),
+        openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description='Transactions per page'),
+    ],
+    responses={200: 'Page of transactions, newest first, with the next page URL', 401: 'Authentication required'}
+)
 @api_view(['GET'])
 def user_transactions(request):
     if not request.user.is_authenticated:
         return Response({'detail': 'Authentication required'}, status=401)
     
-    transactions = Transaction.objects.filter(user=request.user).order_by('-created_at')
+    try:
+        transactions, next_url = paginate_keyset(request, Transaction.objects.filter(user=request.user))
+    except InvalidCursor as e:
+        return Response({'detail': str(e)}, status=400)
     serializer = serializers.TransactionSerializer(transactions, many=True)
-    return Response(serializer.data)
+    return Response({'next': next_url, 'results': serializer.data})
+
+
+def stream_export(request, kind, fmt):
+    if not request.user.is_authenticated:
+        return Response({'detail': 'Authentication required'}, status=401)
+    if fmt not in CONTENT_TYPES:
+        return Response({'detail': 'Unsupported export format'}, status=404)
+
+    serializer = serializers.ExportFilterSerializer(data=request.GET.dict())
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=400)
+
+    user = request.user
+    if serializer.validated_data['scope'] == 'all':
+        if not request.user.is_staff:
+            return Response({'detail': 'Only staff can export every user'}, status=403)
+        user = None
+
+    queryset = export_queryset(
+        kind, user, serializer.validated_data.get('start'), serializer.validated_data.get('end')
+    )
+    response = StreamingHttpResponse(export_lines(kind, queryset, fmt), content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=serializers.ExportFilterSerializer,
+    responses={200: 'CSV or JSONL stream of bookings', 401: 'Authentication required', 403: 'Staff only'}
+)
+@api_view(['GET'])
+def booking_export(request, fmt):
+    return stream_export(request, 'bookings', fmt)
+
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=serializers.ExportFilterSerializer,
+    responses={200: 'CSV or JSONL stream of transactions', 401: 'Authentication required', 403: 'Staff only'}
+)
+@api_view(['GET'])
+def transaction_export(request, fmt):
+    return stream_export(request, 'transactions', fmt)
+
+
+@swagger_auto_schema(
+    method='get',
+    responses={200: 'Hits, misses and size of this process\'s user cache', 401: 'Authentication required', 403: 'Staff only'}
+)
+@api_view(['GET'])
+def auth_cache_stats(request):
+    if not request.user.is_authenticated:
+        return Response({'detail': 'Authentication required'}, status=401)
+    if not request.user.is_staff:
+        return Response({'detail': 'Only staff can view cache statistics'}, status=403)
+    return Response(user_cache.stats())
 
 
 from django.http import HttpResponse
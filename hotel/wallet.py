@@ -0,0 +1,120 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Max, Sum, When
+from django.utils import timezone
+
+from .auth import invalidate_user
+from .models import Profile, Transaction, WalletCheckpoint
+
+CREDIT_TYPES = ('Deposit', 'Refund')
+DEBIT_TYPES = ('Booking Payment',)
+
+# Leave recent transactions out of checkpoints so one that was inserted
+# with a lower id but committed later is never skipped
+CHECKPOINT_LAG = timedelta(minutes=5)
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+# Balances move with single-statement UPDATEs, so concurrent deposits and
+# payments only hold the profile row for the duration of one statement and
+# never overwrite each other. Each movement is recorded in Transaction in
+# the same database transaction. The UPDATEs skip the Profile signals, so
+# each one invalidates the cached user snapshot itself.
+
+@transaction.atomic
+def deposit(user_id, amount):
+    Profile.objects.filter(user_id=user_id).update(wallet_balance=F('wallet_balance') + amount)
+    invalidate_user(user_id)
+    return Transaction.objects.create(user_id=user_id, amount=amount, transaction_type='Deposit')
+
+
+@transaction.atomic
+def pay(user_id, amount, booking):
+    debited = Profile.objects.filter(
+        user_id=user_id,
+        wallet_balance__gte=amount,
+    ).update(wallet_balance=F('wallet_balance') - amount)
+    if not debited:
+        raise InsufficientBalance('Insufficient wallet balance.')
+    invalidate_user(user_id)
+    return Transaction.objects.create(
+        user_id=user_id, booking=booking, amount=amount, transaction_type='Booking Payment'
+    )
+
+
+@transaction.atomic
+def pay_many(user_id, bookings):
+    # One debit for the whole basket and one ledger row per booking
+    total = sum(booking.total_price for booking in bookings)
+    debited = Profile.objects.filter(
+        user_id=user_id,
+        wallet_balance__gte=total,
+    ).update(wallet_balance=F('wallet_balance') - total)
+    if not debited:
+        raise InsufficientBalance('Insufficient wallet balance.')
+    invalidate_user(user_id)
+    return Transaction.objects.bulk_create([
+        Transaction(user_id=user_id, booking=booking, amount=booking.total_price, transaction_type='Booking Payment')
+        for booking in bookings
+    ])
+
+
+@transaction.atomic
+def refund(user_id, amount, booking):
+    Profile.objects.filter(user_id=user_id).update(wallet_balance=F('wallet_balance') + amount)
+    invalidate_user(user_id)
+    return Transaction.objects.create(
+        user_id=user_id, booking=booking, amount=amount, transaction_type='Refund'
+    )
+
+
+def current_balance(user_id):
+    return Profile.objects.values_list('wallet_balance', flat=True).get(user_id=user_id)
+
+
+def signed_amount():
+    return Case(
+        When(transaction_type__in=DEBIT_TYPES, then=-F('amount')),
+        default=F('amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def ledger_balance(user_id, up_to=None):
+    # Latest checkpoint plus everything recorded after it
+    checkpoint = WalletCheckpoint.objects.filter(user_id=user_id).order_by('-id').first()
+    transactions = Transaction.objects.filter(user_id=user_id)
+    balance = 0
+    if checkpoint is not None:
+        balance = checkpoint.balance
+        if checkpoint.last_transaction_id is not None:
+            transactions = transactions.filter(id__gt=checkpoint.last_transaction_id)
+    if up_to is not None:
+        transactions = transactions.filter(id__lte=up_to)
+    return balance + (transactions.aggregate(total=Sum(signed_amount()))['total'] or 0)
+
+
+def create_checkpoints():
+    # One checkpoint per user with settled transactions since their last one;
+    # returns (user_id, ledger balance, profile balance) for every wallet
+    # whose profile balance no longer matches the ledger.
+    settled = Transaction.objects.filter(created_at__lt=timezone.now() - CHECKPOINT_LAG)
+    mismatched = []
+    latest = settled.values('user_id').annotate(last_id=Max('id'))
+    for row in latest.iterator():
+        user_id, last_id = row['user_id'], row['last_id']
+        previous = WalletCheckpoint.objects.filter(user_id=user_id).order_by('-id').first()
+        if previous is not None and previous.last_transaction_id is not None and previous.last_transaction_id >= last_id:
+            continue
+        balance = ledger_balance(user_id, up_to=last_id)
+        WalletCheckpoint.objects.create(user_id=user_id, balance=balance, last_transaction_id=last_id)
+
+    for user_id, profile_balance in Profile.objects.values_list('user_id', 'wallet_balance').iterator():
+        balance = ledger_balance(user_id)
+        if balance != profile_balance:
+            mismatched.append((user_id, balance, profile_balance))
+    return mismatched
@@ -19,7 +19,15 @@ env = environ.Env()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# .env wins over the environment, except for the variables that pick the
+# database: `bench_bookings` sets those per run
+DATABASE_ENV = {
+    key: os.environ[key]
+    for key in ('DB_PROFILE', 'SQLITE_PATH', 'SQLITE_JOURNAL_MODE', 'DATABASE_URL')
+    if key in os.environ
+}
 environ.Env.read_env(os.path.join(BASE_DIR, ".env"), overwrite=True)
+os.environ.update(DATABASE_ENV)
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
@@ -52,10 +60,28 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'hotel.auth.CachedJWTAuthentication',
     ),
+    # Token buckets for hotel.throttling: bursts of N, refilled at N per period
+    'DEFAULT_THROTTLE_RATES': {
+        'search': env('THROTTLE_RATE_SEARCH', default='60/min'),
+        'booking': env('THROTTLE_RATE_BOOKING', default='20/min'),
+    },
 }
 
+# Per-process cache of authenticated users and their profiles. 'auto' uses
+# it only when CACHE_URL points at a cache shared by every worker, which
+# is what carries invalidations between processes
+AUTH_USER_CACHE = env.bool('AUTH_USER_CACHE', default=None)
+if AUTH_USER_CACHE is None:
+    AUTH_USER_CACHE = 'auto'
+AUTH_USER_CACHE_TTL = env.int('AUTH_USER_CACHE_TTL', default=60)
+AUTH_USER_CACHE_MAX_USERS = env.int('AUTH_USER_CACHE_MAX_USERS', default=10000)
+
+# Keyset pagination for list endpoints (?page_size= is capped at the maximum)
+KEYSET_PAGE_SIZE = 20
+KEYSET_MAX_PAGE_SIZE = 100
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=25),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -101,14 +127,87 @@ WSGI_APPLICATION = 'hotel_management_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_PROFILE picks the database setup:
+#   sqlite        - SQLite tuned for concurrent writers (default): busy
+#                   timeout and mmap via SQLITE_PRAGMAS, applied by
+#                   hotel.signals on every new connection, plus persistent
+#                   connections and immediate write transactions. WAL is
+#                   opt-in (SQLITE_JOURNAL_MODE=WAL) since it is stored in
+#                   the database file and would rewrite the tracked one
+#   sqlite-basic  - SQLite with Django's defaults, for comparison
+#   postgres      - DATABASE_URL with a psycopg connection pool (needs
+#                   `pip install "psycopg[binary,pool]"`)
+DB_PROFILE = env('DB_PROFILE', default='sqlite')
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {'default': env.db('DATABASE_URL')}
+    # Pooled connections replace persistent ones, so CONN_MAX_AGE stays 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+            'max_size': env.int('DB_POOL_MAX_SIZE', default=20),
+            'timeout': env.int('DB_POOL_TIMEOUT', default=10),
+        },
     }
-}
+    SQLITE_PRAGMAS = {}
+elif DB_PROFILE == 'sqlite-basic':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+    SQLITE_PRAGMAS = {}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=600),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Take the write lock at BEGIN so a transaction never fails
+                # upgrading from a read lock; waiting is left to busy_timeout
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+    SQLITE_PRAGMAS = {
+        'busy_timeout': env.int('SQLITE_BUSY_TIMEOUT_MS', default=5000),
+        'mmap_size': env.int('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024),
+    }
+    SQLITE_JOURNAL_MODE = env('SQLITE_JOURNAL_MODE', default='')
+    if SQLITE_JOURNAL_MODE:
+        SQLITE_PRAGMAS = {'journal_mode': SQLITE_JOURNAL_MODE, 'synchronous': 'NORMAL', **SQLITE_PRAGMAS}
+
 
 
+# Cache (CACHE_URL, e.g. redis://127.0.0.1:6379/1; local memory by default)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+    # Throttle buckets; point at a shared cache to throttle across workers
+    'throttle': env.cache('THROTTLE_CACHE_URL', default='locmemcache://throttle'),
+}
+THROTTLE_CACHE = 'throttle'
+# Requests in flight per process above which each endpoint class is shed
+# with a 503: search goes first, the rest is kept for bookings. Admission
+# counts within one process, so it needs threaded workers (e.g. gunicorn
+# --threads, set WEB_THREADS to match); with one thread per process nothing
+# is ever in flight alongside a request, so it is left off and only the
+# throttle rates apply. By default search may use half the threads.
+WEB_THREADS = env.int('WEB_THREADS', default=1)
+ADMISSION_LIMITS = {
+    endpoint_class: limit
+    for endpoint_class, limit in {
+        'search': env.int('ADMISSION_LIMIT_SEARCH', default=max(WEB_THREADS // 2, 1) if WEB_THREADS > 1 else None),
+        'booking': env.int('ADMISSION_LIMIT_BOOKING', default=WEB_THREADS if WEB_THREADS > 1 else None),
+    }.items()
+    if limit is not None
+}
+ADMISSION_RETRY_AFTER = 1
+# Seconds a serialized catalogue response stays cached for a given version
+CATALOGUE_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -147,6 +246,14 @@ USE_TZ = True
 STATIC_URL = 'static/'
 MEDIA_ROOT = BASE_DIR/'media'
 MEDIA_URL = '/media/'
+# Hand media bodies to the front-end server instead of Django:
+# 'x-accel-redirect' (nginx, internal location MEDIA_SENDFILE_PREFIX) or
+# 'x-sendfile' (Apache mod_xsendfile, lighttpd). Unset, Django streams the
+# file and WSGI servers with file_wrapper still use sendfile.
+MEDIA_SENDFILE = env('MEDIA_SENDFILE', default=None)
+MEDIA_SENDFILE_PREFIX = env('MEDIA_SENDFILE_PREFIX', default='/protected-media/')
+# Cache lifetime for media whose names aren't content hashes
+MEDIA_CACHE_MAX_AGE = env.int('MEDIA_CACHE_MAX_AGE', default=3600)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field